@@ -3,6 +3,9 @@
 #include <map>
 #include <cstdlib>
 #include <sstream>
+#include <vector>
+#include <cstring>
+#include <stdint.h>
 
 using namespace std;
 
@@ -11,6 +14,13 @@ const double TICK_MOVE = 0.01,
 			 COLOR_SENSOR_DIST = 0.5;
 const int FIELD_SIZE_CM = 22;
 
+// Set to true to ask the simulator for the faster framed protocol
+const bool USE_FRAMED_PROTOCOL = false;
+// Set to true to get color only after SENSE_COLOR command
+const bool USE_EXPLICIT_COLOR = false;
+// Set to true to let the simulator reuse this process for the next runs
+const bool USE_RESET = false;
+
 enum ACTIONS {
 	TURN, BEEP, MOVE, FINISH
 };
@@ -78,35 +88,94 @@ public:
 
 };
 
-void read_config(Robot& r) {
+// Returns false at the end of input
+bool read_config(Robot& r) {
 	int i = 11;
 	string key, line;
 	double value;
 	while (i--) {
-		getline(cin,line);
+		if (!getline(cin, line) || line.empty()) {
+			return false;
+		}
 		line.replace(line.find(":"),1," ");
 		stringstream ss(line);
 		ss>>key>>value;
 		r.vars[key] = value;
 		cerr << "Initialize key:" << key << " with:" << value << endl;
 	}
+	return true;
 }
 
-int main(int argc, char* argv[]) {
-	srand (time(NULL));
-	Robot robot;
-	read_config(robot);
-	bool running = true;
+uint64_t read_big_endian(const unsigned char* p, int n) {
+	uint64_t value = 0;
+	for (int i = 0; i < n; i++) {
+		value = (value << 8) | p[i];
+	}
+	return value;
+}
+
+double read_double(const unsigned char* p) {
+	uint64_t bits = read_big_endian(p, 8);
+	double value;
+	memcpy(&value, &bits, sizeof(value));
+	return value;
+}
+
+// Main loop of framed protocol, returns true if the simulator asked for reset
+bool run_framed(Robot& robot) {
+	unsigned char header[4];
+	while (cin.read((char*) header, 4)) {
+		uint32_t length = (uint32_t) read_big_endian(header, 4);
+		std::vector<unsigned char> payload(length + 1);
+		if (!cin.read((char*) &payload[0], length)) {
+			break;
+		}
+		for (uint32_t i = 0; i < length;) {
+			char tag = payload[i++];
+			if (tag == 'a') {
+				Action response = robot.act();
+				cout << response << endl;
+				if (response.a == FINISH && !USE_RESET) {
+					return false;
+				}
+			} else if (tag == 'c') {
+				robot.on_sense_color(payload[i], payload[i + 1], payload[i + 2]);
+				i += 3;
+			} else if (tag == 't') {
+				robot.on_time(read_double(&payload[i]));
+				i += 8;
+			} else if (tag == 'r') {
+				return true;
+			} else {
+				throw exception();
+			}
+		}
+	}
+	return false;
+}
+
+// Main loop of text protocol, returns true if the simulator asked for reset
+bool run(Robot& robot) {
+	bool protocol_sent = !(USE_FRAMED_PROTOCOL || USE_EXPLICIT_COLOR || USE_RESET);
 	string cmd, line;
-	while (running) {
-		getline(cin, cmd);
+	while (getline(cin, cmd)) {
 		if (cmd == "act") {
-			Action response = robot.act();
-			if (response.a == FINISH) {
-				running = false;
+			if (!protocol_sent) {
+				protocol_sent = true;
+				cout << "PROTOCOL " << (USE_FRAMED_PROTOCOL ? "FRAMED" : "TEXT")
+						<< (USE_EXPLICIT_COLOR ? " EXPLICIT_COLOR" : "")
+						<< (USE_RESET ? " RESET" : "") << endl;
+				if (USE_FRAMED_PROTOCOL) {
+					return run_framed(robot);
+				}
+				continue;
 			}
+			Action response = robot.act();
 			cout << response << endl;
 			// cout << ACTIONS_STRING[response.a] << " " << response.par << endl;
+			if (response.a == FINISH && !USE_RESET) {
+				return false;
+			}
 		} else if (cmd == "color") {
 			getline(cin, line);
 
@@ -122,10 +191,24 @@ int main(int argc, char* argv[]) {
 			double elapsed;
 			ss >> elapsed;
 			robot.on_time(elapsed);
+		} else if (cmd == "reset") {
+			return true;
 		} else {
 			throw exception();
 		}
 	}
-	return 0;
+	return false;
 }
 
+int main(int argc, char* argv[]) {
+	srand (time(NULL));
+	while (true) {
+		Robot robot;
+		if (!read_config(robot) || !run(robot)) {
+			break;
+		}
+		// Reset acknowledged, parameters of the next run follow
+		cout << "RESET" << endl;
+	}
+	return 0;
+}
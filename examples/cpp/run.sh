@@ -5,10 +5,7 @@ LOG=$ABSOLUTE_PATH/out.log
 echo "Init output log at $(date)" > "$LOG"
 cd "$ABSOLUTE_PATH"
 
-if [ -e ./robot.bin ];then
-    make clean  >> "$LOG" 2>&1
-fi
-
+# make rebuilds robot.bin only if main.cpp has changed
 make robot  >> "$LOG" 2>&1
 if [ $? -eq 0 ]; then
     ./robot.bin
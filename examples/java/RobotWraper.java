@@ -1,3 +1,7 @@
+import java.io.BufferedInputStream;
+import java.io.DataInputStream;
+import java.io.EOFException;
+import java.io.IOException;
 import java.lang.reflect.Field;
 import java.util.Random;
 import java.util.Scanner;
@@ -17,6 +21,19 @@ public class RobotWraper {
 	public static final String MOVE = "MOVE";
 	public static final String FINISH = "FINISH";
 
+	public static final String PROTOCOL = "PROTOCOL";
+	public static final String FRAMED = "FRAMED";
+	public static final String TEXT = "TEXT";
+	public static final String EXPLICIT_COLOR = "EXPLICIT_COLOR";
+	public static final String RESET = "RESET";
+
+	/* Set to true to ask the simulator for the faster framed protocol */
+	public static final boolean USE_FRAMED_PROTOCOL = false;
+	/* Set to true to get color only after SENSE_COLOR command */
+	public static final boolean USE_EXPLICIT_COLOR = false;
+	/* Set to true to let the simulator reuse this process for the next runs */
+	public static final boolean USE_RESET = false;
+
 	/* Simulation vars, they MUST be named in python_way */
 	private double x, y, angle, steering_noise, distance_noise, forward_steering_drift;
 	private double speed, turning_speed, execution_cpu_time_limit, M, N;
@@ -64,12 +81,16 @@ public class RobotWraper {
 		elapsedTime = elapsed;
 	}
 
+	/* Returns null at the end of input */
 	static public RobotWraper robotFromConfig(Scanner sc) throws Exception {
 		RobotWraper robot = new RobotWraper();
 		String line, key, value;
 		String tmp[];
 		Class<?> c = robot.getClass();
 		for (int i = 0; i < 11; i++) {// 11 parameters expected
+			if (!sc.hasNextLine()) {
+				return null;
+			}
 			line = sc.nextLine();
 			tmp = line.split(":");
 			key = tmp[0];
@@ -86,20 +107,66 @@ public class RobotWraper {
 		return robot;
 	}
 
-	public static void main(String[] args) throws Exception {
+	/* Main loop of framed protocol, returns true if the simulator asked for reset */
+	static boolean runFramed(RobotWraper robot) throws IOException {
+		DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+		while (true) {
+			int length;
+			try {
+				length = in.readInt();
+			} catch (EOFException e) {
+				return false;
+			}
+			int read = 0;
+			while (read < length) {
+				char tag = (char) in.readUnsignedByte();
+				read += 1;
+				if (tag == 'a') {
+					Action response = robot.act();
+					System.out.println(response);
+					System.out.flush();
+					if (response.action.equals(FINISH) && !USE_RESET) {
+						return false;
+					}
+				} else if (tag == 'c') {
+					robot.onSenseColor(in.readUnsignedByte(), in.readUnsignedByte(), in.readUnsignedByte());
+					read += 3;
+				} else if (tag == 't') {
+					robot.onTime(in.readDouble());
+					read += 8;
+				} else if (tag == 'r') {
+					return true;
+				} else {
+					throw new RuntimeException("Not recognized record \"" + tag + "\" ");
+				}
+			}
+		}
+	}
+
+	/* Main loop of text protocol, returns true if the simulator asked for reset */
+	static boolean run(RobotWraper robot, Scanner sc) throws IOException {
 		String cmd,line;
-		Scanner sc = new Scanner (System.in);
-		RobotWraper robot = robotFromConfig(sc);
-		boolean running = true;
-		while (running) {
+		boolean protocolSent = !(USE_FRAMED_PROTOCOL || USE_EXPLICIT_COLOR || USE_RESET);
+		while (sc.hasNextLine()) {
 			cmd = sc.nextLine().replaceAll("\\s+", "");
 			if (cmd.equalsIgnoreCase("act")) {
-				Action response = robot.act();
-				if (response.action.equals(FINISH)){
-					running=false;
+				if (!protocolSent) {
+					protocolSent = true;
+					System.out.println(PROTOCOL + " " + (USE_FRAMED_PROTOCOL ? FRAMED : TEXT)
+							+ (USE_EXPLICIT_COLOR ? " " + EXPLICIT_COLOR : "")
+							+ (USE_RESET ? " " + RESET : ""));
+					System.out.flush();
+					if (USE_FRAMED_PROTOCOL) {
+						return runFramed(robot);
+					}
+					continue;
 				}
-				System.out.println(robot.act());
+				Action response = robot.act();
+				System.out.println(response);
 				System.out.flush();
+				if (response.action.equals(FINISH) && !USE_RESET) {
+					return false;
+				}
 			} else if (cmd.equalsIgnoreCase("color")) {
 				line = sc.nextLine();
 				Scanner sc2 = new Scanner(line);
@@ -110,11 +177,23 @@ public class RobotWraper {
 				Scanner sc2 = new Scanner(line);
 				robot.onTime(sc2.nextDouble());
 				sc2.close();
+			} else if (cmd.equalsIgnoreCase("reset")) {
+				return true;
 			} else {
-				sc.close();
 				throw new RuntimeException("Not recognized cmd \"" + cmd + "\" ");
 			}
 		}
+		return false;
+	}
+
+	public static void main(String[] args) throws Exception {
+		Scanner sc = new Scanner (System.in);
+		RobotWraper robot;
+		while ((robot = robotFromConfig(sc)) != null && run(robot, sc)) {
+			// Reset acknowledged, parameters of the next run follow
+			System.out.println(RESET);
+			System.out.flush();
+		}
 		sc.close();
 	}
 }
@@ -6,15 +6,16 @@ JAVA_FILE='RobotWraper'
 echo "Init output log at $(date)" > "$LOG"
 cd "$ABSOLUTE_PATH"
 
-javac "$JAVA_FILE" >> "$LOG" 2>&1
+# Compile only if the source has changed since the last build
+if [ ! "./${JAVA_FILE}.class" -nt "./${JAVA_FILE}.java" ];then
+    if [ -e "./${JAVA_FILE}.class" ];then
+        echo "Removing ${JAVA_FILE}.class file" >> "$LOG" 2>&1
+        rm "./${JAVA_FILE}.class"
+    fi
 
-if [ -e "./${JAVA_FILE}.class" ];then
-    echo "Removing ${JAVA_FILE}.class file" >> "$LOG" 2>&1
-    rm "./${JAVA_FILE}.class"
+    javac "${JAVA_FILE}.java" >> "$LOG" 2>&1
 fi
 
-javac "${JAVA_FILE}.java" >> "$LOG" 2>&1
-
 if [ -e "./${JAVA_FILE}.class" ];then
     java "$JAVA_FILE"
 else
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+import struct
 import random
 from random import random as rand
 import math
@@ -11,6 +12,14 @@ BEEP = "BEEP"
 MOVE = "MOVE"
 FINISH = "FINISH"
 
+# Set to True to ask the simulator for the faster framed protocol
+USE_FRAMED_PROTOCOL = False
+# Set to True to get color only after SENSE_COLOR command
+USE_EXPLICIT_COLOR = False
+# Set to True to let the simulator reuse this process for the next runs
+USE_RESET = False
+FRAME_RECORDS = {"c": ">BBB", "t": ">d", "s": ">d", "g": ">dd", "a": "", "r": ""}
+
 TICK_MOVE = 0.01
 TICK_ROTATE = 0.002
 COLOR_SENSOR_DIST = 0.5
@@ -66,28 +75,101 @@ class TemplateBot(object):
     def on_time(self, time):
         self.elapsed_time = time
 
-if __name__ == "__main__":
-    robot = TemplateBot()
-    robot_kwargs = {}
-    for i in range(11): # 11 parameters expected
-        w = sys.stdin.readline().strip()
-        key, value = w.split(":")
-        robot_kwargs[key] = float(value)
-    robot.init(**robot_kwargs)
-
-    running = True
-    while  running:
-        cmd = sys.stdin.readline().strip()
+def read_frame(stream):
+    """ Reads single framed message and returns list of (tag, values) records """
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    payload = stream.read(struct.unpack(">I", header)[0])
+    records, i = [], 0
+    while i < len(payload):
+        tag = payload[i:i + 1].decode("ascii")
+        size = struct.calcsize(FRAME_RECORDS[tag])
+        records.append((tag, struct.unpack(FRAME_RECORDS[tag], payload[i + 1:i + 1 + size])))
+        i += 1 + size
+    return records
+
+def protocol_line():
+    """ Returns line switching protocol, answered to the first act request """
+    line = "PROTOCOL " + ("FRAMED" if USE_FRAMED_PROTOCOL else "TEXT")
+    if USE_EXPLICIT_COLOR:
+        line += " EXPLICIT_COLOR"
+    if USE_RESET:
+        line += " RESET"
+    return line
+
+def run_framed(robot):
+    """ Main loop of framed protocol, returns True if the simulator asked for reset """
+    while True:
+        records = read_frame(sys.stdin.buffer)
+        if records is None:
+            return False
+        for tag, values in records:
+            if tag == "a":
+                response = robot.act()
+                sys.stdout.write(" ".join(map(str, response)) + "\n")
+                sys.stdout.flush()
+                if response[0] == FINISH and not USE_RESET:
+                    return False
+            elif tag == "c":
+                robot.on_sense_color(*values)
+            elif tag == "t":
+                robot.on_time(values[0])
+            elif tag == "r":
+                return True
+            else:
+                raise RuntimeError("Not recognized record \"" + tag + "\"")
+
+def run(robot):
+    """ Main loop of text protocol, returns True if the simulator asked for reset """
+    protocol_sent = not (USE_FRAMED_PROTOCOL or USE_EXPLICIT_COLOR or USE_RESET)
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            return False
+        cmd = line.strip()
         if cmd == "act":
+            if not protocol_sent:
+                protocol_sent = True
+                sys.stdout.write(protocol_line() + "\n")
+                sys.stdout.flush()
+                if USE_FRAMED_PROTOCOL:
+                    return run_framed(robot)
+                continue
             response = robot.act()
-            if response[0] == FINISH:
-                running = False
             sys.stdout.write(" ".join(map(str, response)) + "\n")
             sys.stdout.flush()
+            if response[0] == FINISH and not USE_RESET:
+                return False
         elif cmd == "color":
             r, g, b = map(int, input().split())
             robot.on_sense_color(r, g, b)
         elif cmd == "time":
             robot.on_time(float(input()))
+        elif cmd == "reset":
+            return True
         else:
             raise RuntimeError("Not recognized cmd \"" + cmd + "\"")
+
+def read_parameters():
+    """ Returns parameters of the run or None at the end of input """
+    robot_kwargs = {}
+    for i in range(11): # 11 parameters expected
+        w = sys.stdin.readline().strip()
+        if not w:
+            return None
+        key, value = w.split(":")
+        robot_kwargs[key] = float(value)
+    return robot_kwargs
+
+if __name__ == "__main__":
+    robot_kwargs = read_parameters()
+    while robot_kwargs is not None:
+        robot = TemplateBot()
+        robot.init(**robot_kwargs)
+        if not run(robot):
+            break
+        # Reset acknowledged, parameters of the next run follow
+        sys.stdout.write("RESET\n")
+        sys.stdout.flush()
+        robot_kwargs = read_parameters()
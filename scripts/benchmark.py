@@ -0,0 +1,355 @@
+#! /bin/python2.7
+"""
+Benchmarks of the simulator hot paths.
+
+Every benchmark runs a fixed, seeded workload (so that runs are comparable)
+--repeat times and reports the median rate (of CPU time, so that other
+processes disturb it less): ticks per second for the robot movement and the
+whole simulation, calls per second otherwise. Whole simulations are runs of
+a scripted bot driving laps around the board (without collisions).
+
+Results are compared with the baseline (benchmark_baseline.json next to this
+script, see --baseline) and the script exits with status 1 if any rate is
+lower than the baseline one by more than --threshold. Baseline is measured
+on a particular machine, so it should be updated (see --update_baseline)
+when the benchmarks are run elsewhere or when a change is meant to make
+them slower.
+
+    python2.7 scripts/benchmark.py
+    python2.7 scripts/benchmark.py -k simulator --repeat 5
+"""
+
+from collections import OrderedDict
+from optparse import OptionParser
+from math import pi
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from map import load_map, get_color, get_sonar_table
+from misc.defines import *
+from misc.visualisation import RenderAnimatedPart, RenderFrameTemplate, PrepareFrame, IncrementalPath
+from robot import Robot
+from robot_controller import RobotController
+from simulator import KrakrobotSimulator
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator", "maps")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+SEED = 777
+
+# Same defaults as in simulator/main.py
+SIMULATOR_PARAMS = {
+    "speed": 0.2,
+    "turning_speed": 1.0,
+    "execution_cpu_time_limit": 100.0,
+    "simulation_time_limit": 240.0,
+    "frame_dt": 0.25,
+    "iteration_write_frequency": 1000,
+    "steering_noise": 0.0004 * 1e-2,
+    "distance_noise": 0.001 * 1e-2,
+    "forward_steering_drift": 0.008 * 1e-2,
+    "measurement_noise": 0.,
+    "color_noise": 0.,
+    "sonar_noise": 0.,
+    "gps_delay": 0.,
+}
+
+
+def create_parser():
+    """ Configure options and return parser object """
+    parser = OptionParser()
+    parser.add_option(
+        "-b",
+        "--baseline",
+        dest="baseline",
+        default=DEFAULT_BASELINE,
+        help="Path to json file with the baseline results"
+    )
+    parser.add_option(
+        "-t",
+        "--threshold",
+        dest="threshold",
+        type="float",
+        default=0.25,
+        help="Maximum allowed relative slowdown against the baseline"
+    )
+    parser.add_option(
+        "-r",
+        "--repeat",
+        dest="repeat",
+        type="int",
+        default=5,
+        help="Number of timed runs of every benchmark (the median one is reported)"
+    )
+    parser.add_option(
+        "-k",
+        "--filter",
+        dest="filter",
+        default="",
+        help="Run only benchmarks with names containing the string"
+    )
+    parser.add_option(
+        "-o",
+        "--output_file",
+        dest="output_file",
+        default=None,
+        help="Path to json file to write the results to"
+    )
+    parser.add_option(
+        "--update_baseline",
+        dest="update_baseline",
+        action="store_true",
+        default=False,
+        help="Write the results to the baseline file instead of comparing them"
+    )
+    return parser
+
+
+class ScriptedRobotController(RobotController):
+    """
+    Deterministic bot run in the simulator process: drives laps of a square
+    (side cells on a side, starting at the start field heading along x) with
+    color sensed every half of a cell and a beep at every corner, then
+    finishes. Route is collision-free on the boards without inner walls
+    """
+
+    def __init__(self, laps=2, side=4):
+        self.laps = laps
+        self.side = side
+
+    def clone(self):
+        return ScriptedRobotController(self.laps, self.side)
+
+    def init(self, **kwargs):
+        half_cell = int(round(0.5 / TICK_MOVE))
+        # Negative TURN turns towards increasing y (into the board from the start field)
+        quarter_turn = -int(round(pi / 2 / TICK_ROTATE))
+        leg = [[MOVE, half_cell], [SENSE_COLOR]] * (2 * self.side) + [[BEEP], [TURN, quarter_turn]]
+        self.commands = iter(leg * 4 * self.laps + [[FINISH]])
+
+    def act(self, current_time, color=None):
+        return next(self.commands)
+
+    def on_sense_color(self, r, g, b):
+        pass
+
+
+def _map_file(name):
+    return os.path.join(MAPS_DIR, name)
+
+
+def _create_robot():
+    robot = Robot(SIMULATOR_PARAMS["speed"], SIMULATOR_PARAMS["turning_speed"], 0.0, 0.0,
+                  TICK_MOVE, TICK_ROTATE, seed=SEED)
+    robot.set(2.5, 2.5, 0.0)
+    robot.set_noise(new_s_noise=SIMULATOR_PARAMS["steering_noise"],
+                    new_d_noise=SIMULATOR_PARAMS["distance_noise"],
+                    new_m_noise=0.0,
+                    new_fs_drift=SIMULATOR_PARAMS["forward_steering_drift"],
+                    new_sonar_noise=0.0,
+                    new_c_noise=0.0)
+    return robot
+
+
+def _random_poses(map_, count):
+    """ :returns list of (x, y, orientation) within the board """
+    rng = np.random.RandomState(SEED)
+    return zip(rng.uniform(1.0, map_["N"] - 1.0, count).tolist(),
+               rng.uniform(1.0, map_["M"] - 1.0, count).tolist(),
+               rng.uniform(0.0, 2 * pi, count).tolist())
+
+
+# Every benchmark prepares its workload and returns function running it and
+# the number of ticks (or calls) it makes
+
+def robot_move():
+    robot = _create_robot()
+    count = 20000
+
+    def run():
+        robot.set(2.5, 2.5, 0.0)
+        for _ in xrange(count):
+            robot.move(1)
+    return run, count
+
+
+def robot_turn():
+    robot = _create_robot()
+    count = 20000
+
+    def run():
+        for _ in xrange(count):
+            robot.turn(1)
+    return run, count
+
+
+def robot_sense_color():
+    map_ = load_map(_map_file("1.map"))
+    robot = _create_robot()
+    poses = _random_poses(map_, 5000)
+
+    def run():
+        for pose in poses:
+            robot.x, robot.y, robot.orientation = pose
+            robot.sense_color(map_)
+    return run, len(poses)
+
+
+def robot_sense_sonar(sonar_table=True):
+    map_ = load_map(_map_file("1.map"))
+    grid = map_["board"]
+    table = get_sonar_table(map_) if sonar_table else None
+    robot = _create_robot()
+    poses = _random_poses(map_, 5000)
+
+    def run():
+        for pose in poses:
+            robot.x, robot.y, robot.orientation = pose
+            robot.sense_sonar(grid, table)
+    return run, len(poses)
+
+
+def map_get_color():
+    map_ = load_map(_map_file("1.map"))
+    points = [pose[:2] for pose in _random_poses(map_, 20000)]
+
+    def run():
+        for x, y in points:
+            get_color(map_, x, y)
+    return run, len(points)
+
+
+def map_load_map():
+    count = 5
+
+    def run():
+        for _ in xrange(count):
+            load_map(_map_file("1.map"))
+    return run, count
+
+
+def render_animated_part():
+    """ Frames of a path growing by 20 vertices, rendered as in the GUI """
+    map_ = load_map(_map_file("1.map"))
+    rng = np.random.RandomState(SEED)
+    path = (np.cumsum(rng.uniform(-0.05, 0.05, (2000, 2)), axis=0) + 2.5).tolist()
+    data = {"Map": map_, "StartPos": (2.5, 2.5, 0.0), "Sparks": [(2.5, 2.5, 0.0)],
+            "ActualPosition": path[0], "ActualOrientation": 0.0, "ActualPath": []}
+    frame_template = RenderFrameTemplate(data)
+    frames = range(20, len(path) + 1, 20)
+
+    def run():
+        path_renderer = IncrementalPath()
+        for frame in frames:
+            data["ActualPath"] = path[:frame]
+            data["ActualPosition"] = path[frame - 1]
+            PrepareFrame(frame_template, RenderAnimatedPart(data, path_renderer))
+    return run, len(frames)
+
+
+def simulator_run(map_name):
+    """ Whole simulation, rate is in ticks (see SimulationStats) """
+    simulator = KrakrobotSimulator(map=_map_file(map_name), robot_controller=ScriptedRobotController(),
+                                   seed=SEED, command_line=True, print_robot=False, **SIMULATOR_PARAMS)
+
+    def run():
+        results = simulator.run()
+        assert not results["error"], "Simulation failed: " + str(results["error"])
+        assert results["finished"], "Bot hasn't finished the route"
+        return simulator.get_stats()["ticks"]
+
+    ticks = run()
+
+    def run_checked():
+        assert run() == ticks, "Simulation isn't deterministic"
+    return run_checked, ticks
+
+
+BENCHMARKS = [
+    ("robot.move", "ticks", robot_move),
+    ("robot.turn", "ticks", robot_turn),
+    ("robot.sense_color", "calls", robot_sense_color),
+    ("robot.sense_sonar", "calls", robot_sense_sonar),
+    ("robot.sense_sonar[cast_ray]", "calls", lambda: robot_sense_sonar(sonar_table=False)),
+    ("map.get_color", "calls", map_get_color),
+    ("map.load_map", "calls", map_load_map),
+    ("visualisation.RenderAnimatedPart", "frames", render_animated_part),
+    ("simulator.run[1.map]", "ticks", lambda: simulator_run("1.map")),
+    ("simulator.run[2.map]", "ticks", lambda: simulator_run("2.map")),
+]
+
+
+def measure(benchmark, repeat):
+    """ :returns dict with rate (per second of the median run) """
+    run, count = benchmark()
+    durations = []
+    for _ in xrange(repeat):
+        start = time.clock()
+        run()
+        durations.append(time.clock() - start)
+    return {"rate": count / float(np.median(durations))}
+
+
+def compare(results, baseline, threshold):
+    """ Prints results against the baseline and returns names of regressed benchmarks """
+    regressions = []
+    print "{0:34} {1:>14} {2:>14} {3:>8}".format("benchmark", "rate", "baseline", "change")
+    for name, result in results.iteritems():
+        reference = baseline.get(name)
+        line = "{0:34} {1:>14}".format(name, "{0:.0f} {1}/s".format(result["rate"], result["unit"]))
+        if reference is None:
+            print line + " {0:>14} {1:>8}".format("-", "-")
+            continue
+        change = result["rate"] / reference["rate"] - 1.0
+        print line + " {0:>14.0f} {1:>+7.1f}%".format(reference["rate"], 100 * change)
+        if change < -threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = create_parser()
+    (options, args) = parser.parse_args()
+
+    results = OrderedDict()
+    stdout = sys.stdout
+    for name, unit, benchmark in BENCHMARKS:
+        if options.filter not in name:
+            continue
+        # Warnings of load_map and simulator
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results[name] = measure(benchmark, options.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        results[name]["unit"] = unit
+    report = {"python": platform.python_version(), "numpy": np.__version__,
+              "machine": platform.machine(), "benchmarks": results}
+
+    if options.output_file:
+        with open(options.output_file, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if options.update_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print "Baseline written to", options.baseline
+        sys.exit(0)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print "Regressions (slower than the baseline by more than {0:.0f}%): {1}".format(
+            100 * options.threshold, ", ".join(regressions))
+        sys.exit(1)
@@ -1,7 +1,79 @@
 #! /bin/python2.7
+"""
+Batch evaluation of robots.
+
+Problem file is a json file describing jobs to run. Jobs can be listed
+explicitly:
+
+    {"jobs": [{"robot": "python2.7 examples/python/run.py",
+               "map": "simulator/maps/1.map",
+               "seed": 777,
+               "noise_profile": "default"}, ...],
+     "noise_profiles": {"default": {"steering_noise": 4e-06, ...}},
+     "parameters": {"simulation_time_limit": 240.0}}
+
+or generated as a cartesian product of "maps", "seeds" and "noise_profiles"
+for the robot given by --robot_file (or "robots" list in the problem file).
+Relative paths of maps (and of robots with --in_process or --build, which
+are paths rather than commands) are resolved against the problem file
+directory.
+
+Jobs are run in a process pool. Each worker runs one simulation (and so one
+robot process) at a time, or --interleave simulations at once, switching
+between them while their bots think (see orchestrator.py). Bots supporting
+RESET (see misc/defines.py) are kept running by the worker and reused by its
+next jobs (see --no_warm_bots). With --build robots are directories of
+sources, built once (into the build cache shared by all the evaluations, see
+build_robot) before the jobs are run; jobs of a robot which fails to build
+get the build error as their result. With --in_process robots are Python
+files with the bot class, run in the worker processes without pipes (see
+PythonRobotController).
+
+Results (with counters of the simulation, see instrumentation.py) are written
+to the output file as json lines in order of completion. Trajectories of the
+runs can be saved as <job id>.npz files for offline analysis (see
+--trajectory_dir) and replays as <job id>.replay files, that can be watched in
+the GUI (see --replay_dir).
+"""
 
 from optparse import OptionParser
 import json
+import multiprocessing
+import os
+import sys
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from simulator import KrakrobotSimulator
+from robot_controller import construct_cmd_robot, construct_python_robot, build_robot, ControllerPool
+from orchestrator import run_interleaved
+from misc.defines import BUILD_CACHE_DIR, CONTROLLER_POOL_SIZE, KrakrobotException
+
+# Same defaults as in simulator/main.py
+DEFAULT_SIMULATOR_PARAMS = {
+    "speed": 0.2,
+    "turning_speed": 1.0,
+    "execution_cpu_time_limit": 100.0,
+    "simulation_time_limit": 240.0,
+    "frame_dt": 0.25,
+    "iteration_write_frequency": 1000,
+
+    # Krakrobot 2016 task doesn't allow for using GPS or sonar
+    "measurement_noise": 0.,
+    "color_noise": 0.,
+    "sonar_noise": 0.,
+    "gps_delay": 0.,
+}
+
+DEFAULT_NOISE_PROFILES = {
+    "default": {
+        "steering_noise": 0.0004 * 1e-2,
+        "distance_noise": 0.001 * 1e-2,
+        "forward_steering_drift": 0.008 * 1e-2,
+    }
+}
+
 
 def create_parser():
     """ Configure options and return parser object """
@@ -27,9 +99,211 @@ def create_parser():
         default="output.json",
         help="Path to destination file"
     )
+    parser.add_option(
+        "-j",
+        "--processes",
+        dest="processes",
+        type="int",
+        default=multiprocessing.cpu_count(),
+        help="Number of worker processes"
+    )
+    parser.add_option(
+        "-t",
+        "--trajectory_dir",
+        dest="trajectory_dir",
+        default=None,
+        help="Directory to save trajectories of the runs to"
+    )
+    parser.add_option(
+        "--replay_dir",
+        dest="replay_dir",
+        default=None,
+        help="Directory to save replays of the runs to"
+    )
+    parser.add_option(
+        "--no_warm_bots",
+        dest="warm_bots",
+        action="store_false",
+        default=True,
+        help="Start new bot process for every job, even if the bot supports RESET"
+    )
+    parser.add_option(
+        "--interleave",
+        dest="interleave",
+        type="int",
+        default=1,
+        help="Number of simulations run at once by every worker process"
+             " (interleaved while their bots think)"
+    )
+    parser.add_option(
+        "--build",
+        dest="build",
+        action="store_true",
+        default=False,
+        help="Robots are directories of sources (with Makefile or .java files)"
+             " to be built (only if not in the build cache yet)"
+    )
+    parser.add_option(
+        "--build_cache_dir",
+        dest="build_cache_dir",
+        default=BUILD_CACHE_DIR,
+        help="Directory of the build cache (see --build)"
+    )
+    parser.add_option(
+        "--in_process",
+        dest="in_process",
+        action="store_true",
+        default=False,
+        help="Robots are Python files with the bot class, to be run in the"
+             " worker processes"
+    )
     return parser
 
 
+def _resolve_path(path, base_dir):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(base_dir, path)
+
+
+def create_jobs(problem, robot, base_dir=".", robot_paths=False):
+    """
+    :param robot_paths: if True robots are paths, resolved like paths of maps
+    :returns list of job dicts with keys robot, map, seed, noise_profile and
+        parameters (ready to be passed to KrakrobotSimulator)
+    """
+    noise_profiles = dict(DEFAULT_NOISE_PROFILES)
+    noise_profiles.update(problem.get("noise_profiles", {}))
+
+    if "jobs" in problem:
+        jobs = [dict(job) for job in problem["jobs"]]
+    else:
+        jobs = []
+        for robot_cmd in problem.get("robots", [robot]):
+            for map_file in problem["maps"]:
+                for seed in problem.get("seeds", [777]):
+                    for profile in problem.get("noise_profiles", DEFAULT_NOISE_PROFILES).keys():
+                        jobs.append({"robot": robot_cmd, "map": map_file, "seed": seed, "noise_profile": profile})
+
+    for job_id, job in enumerate(jobs):
+        job.setdefault("robot", robot)
+        job.setdefault("seed", 777)
+        job.setdefault("noise_profile", "default")
+        job["id"] = job_id
+        job["map"] = _resolve_path(job["map"], base_dir)
+        if robot_paths:
+            job["robot"] = _resolve_path(job["robot"], base_dir)
+        if job["noise_profile"] not in noise_profiles:
+            raise KeyError("Unknown noise profile " + str(job["noise_profile"]))
+
+        parameters = dict(DEFAULT_SIMULATOR_PARAMS)
+        # Noise not specified in the profile falls back to the default one
+        parameters.update(DEFAULT_NOISE_PROFILES["default"])
+        parameters.update(noise_profiles[job["noise_profile"]])
+        parameters.update(problem.get("parameters", {}))
+        job["parameters"] = parameters
+
+    return jobs
+
+
+# Warm bot processes of the worker process (see init_worker)
+controller_pool = None
+
+
+def init_worker(warm_bots, pool_size=CONTROLLER_POOL_SIZE):
+    global controller_pool
+    controller_pool = ControllerPool(pool_size) if warm_bots else None
+
+
+def create_simulator(job):
+    """ :returns simulator of the job (in the worker process) """
+    if job.get("build_error"):
+        raise KrakrobotException(job["build_error"])
+    if job.get("in_process"):
+        robot_controller = construct_python_robot(str(job["robot"]))
+    else:
+        robot_controller = construct_cmd_robot(str(job.get("robot_cmd", job["robot"])), controller_pool)
+    return KrakrobotSimulator(map=str(job["map"]),
+                              robot_controller=robot_controller,
+                              seed=job["seed"],
+                              command_line=True,
+                              print_robot=False,
+                              **job["parameters"])
+
+
+def finish_job(job, simulator, results):
+    """ Saves trajectory and replay of the finished simulation and returns result dict """
+    result = {"job": dict((k, v) for k, v in job.iteritems() if k != "parameters")}
+    try:
+        if job.get("trajectory_file"):
+            simulator.save_trajectory(job["trajectory_file"])
+        if results and job.get("replay_file"):
+            simulator.save_replay(job["replay_file"])
+        if results and "map" in results:
+            del results["map"]
+        result["results"] = results
+        result["stats"] = simulator.get_stats()
+    except Exception, e:
+        result["results"] = {"error": str(e), "error_traceback": traceback.format_exc()}
+    return result
+
+
+def run_job(job):
+    """ Runs single simulation (in the worker process) and returns result dict """
+    try:
+        simulator = create_simulator(job)
+        results = simulator.run()
+    except Exception, e:
+        return {"job": dict((k, v) for k, v in job.iteritems() if k != "parameters"),
+                "results": {"error": str(e), "error_traceback": traceback.format_exc()}}
+    return finish_job(job, simulator, results)
+
+
+def run_jobs(jobs):
+    """
+    Runs simulations of the jobs interleaved in the worker process (see
+    orchestrator.py) and returns list of result dicts
+    """
+    results = [None] * len(jobs)
+    simulators, job_ids = [], []
+    for job_id, job in enumerate(jobs):
+        try:
+            simulators.append(create_simulator(job))
+            job_ids.append(job_id)
+        except Exception, e:
+            results[job_id] = {"job": dict((k, v) for k, v in job.iteritems() if k != "parameters"),
+                               "results": {"error": str(e), "error_traceback": traceback.format_exc()}}
+    for index, run_results in run_interleaved(simulators):
+        results[job_ids[index]] = finish_job(jobs[job_ids[index]], simulators[index], run_results)
+    return results
+
+
+def evaluate(jobs, output_file, processes, warm_bots=True, interleave=1):
+    """
+    Runs jobs in a process pool and streams results as json lines. With
+    interleave > 1 every worker runs that many jobs at once
+    """
+    pool = multiprocessing.Pool(processes=processes, initializer=init_worker,
+                                initargs=(warm_bots, max(CONTROLLER_POOL_SIZE, interleave)))
+    if interleave > 1:
+        batches = [jobs[i:i + interleave] for i in xrange(0, len(jobs), interleave)]
+        results = (result for batch in pool.imap_unordered(run_jobs, batches) for result in batch)
+    else:
+        results = pool.imap_unordered(run_job, jobs)
+    try:
+        with open(output_file, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
 if __name__ == "__main__":
     parser = create_parser()
     (options, args) = parser.parse_args()
@@ -37,3 +311,35 @@ if __name__ == "__main__":
     with open(options.problem_file, "r") as f:
         problem = json.loads(f.read())
 
+    # Robot given in the command line is relative to the working directory
+    robot_paths = options.in_process or options.build
+    robot_file = os.path.abspath(options.robot_file) if robot_paths else options.robot_file
+    jobs = create_jobs(problem, robot_file,
+                       base_dir=os.path.dirname(os.path.abspath(options.problem_file)),
+                       robot_paths=robot_paths)
+    if options.build:
+        robot_cmds, build_errors = {}, {}
+        for job in jobs:
+            if job["robot"] not in robot_cmds and job["robot"] not in build_errors:
+                print "Building {0}".format(job["robot"])
+                try:
+                    robot_cmds[job["robot"]] = build_robot(job["robot"], options.build_cache_dir)
+                except KrakrobotException, e:
+                    print "Failed to build {0}".format(job["robot"])
+                    build_errors[job["robot"]] = str(e)
+            if job["robot"] in build_errors:
+                job["build_error"] = build_errors[job["robot"]]
+            else:
+                job["robot_cmd"] = robot_cmds[job["robot"]]
+    if options.in_process:
+        for job in jobs:
+            job["in_process"] = True
+    for key, directory, extension in (("trajectory_file", options.trajectory_dir, "npz"),
+                                      ("replay_file", options.replay_dir, "replay")):
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for job in jobs:
+                job[key] = os.path.join(directory, "{0}.{1}".format(job["id"], extension))
+    print "Evaluating {0} jobs using {1} processes".format(len(jobs), options.processes)
+    evaluate(jobs, options.output_file, options.processes, options.warm_bots, options.interleave)
@@ -0,0 +1,73 @@
+#! /bin/python2.7
+"""
+Export of replays to animated GIFs (or PNG sequences) without the GUI.
+
+Every replay file (e.g. saved by evaluate_robot.py --replay_dir) is exported
+to <replay name>.gif (or to <replay name> directory of .png files, see
+--png) in the output directory.
+"""
+
+from optparse import OptionParser
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from export import export_replay, EXPORT_SCALE
+
+
+def create_parser():
+    """ Configure options and return parser object """
+    parser = OptionParser(usage="%prog [options] replay_file [replay_file ...]")
+    parser.add_option(
+        "-o",
+        "--output_dir",
+        dest="output_dir",
+        default=".",
+        help="Directory to export replays to"
+    )
+    parser.add_option(
+        "--png",
+        dest="png",
+        action="store_true",
+        default=False,
+        help="Export .png files instead of animated .gif"
+    )
+    parser.add_option(
+        "--scale",
+        dest="scale",
+        type="int",
+        default=EXPORT_SCALE,
+        help="Pixels per board cell"
+    )
+    parser.add_option(
+        "--frame_dt",
+        dest="frame_dt",
+        type="float",
+        default=None,
+        help="Simulation time between frames (default is frame_dt of the run)"
+    )
+    parser.add_option(
+        "--frame_step",
+        dest="frame_step",
+        type="int",
+        default=1,
+        help="Export only every n-th frame"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = create_parser()
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("No replay files given")
+
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    for replay_file in args:
+        name = os.path.splitext(os.path.basename(replay_file))[0]
+        output = os.path.join(options.output_dir, name if options.png else name + ".gif")
+        frames = export_replay(replay_file, output, frame_dt=options.frame_dt,
+                               scale=options.scale, frame_step=options.frame_step)
+        print "Exported {0} frames of {1} to {2}".format(frames, replay_file, output)
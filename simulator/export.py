@@ -0,0 +1,325 @@
+""" Headless export of runs (replays) to PNG sequences and animated GIFs """
+
+import io
+import os
+import struct
+from math import cos, sin, pi
+
+import numpy as np
+from PIL import Image
+
+from misc.defines import *
+from replay import ReplayPlayer
+
+# Frames are composed of indices into PALETTE (so they can be written as GIF
+# frames without quantization)
+PALETTE = [
+    (255, 255, 255),  # background
+    (0, 0, 0),        # grid
+    (179, 0, 0),      # wall
+    (255, 0, 0),      # red field
+    (0, 255, 0),      # green field
+    (0, 0, 255),      # blue field
+    (0, 153, 255),    # start position
+    (68, 0, 255),     # path
+    (221, 0, 0),      # spark (beep)
+    (0, 255, 0),      # robot
+    (128, 0, 128),    # robot outline
+]
+(COLOR_BACKGROUND, COLOR_GRID, COLOR_WALL, COLOR_RED, COLOR_GREEN, COLOR_BLUE,
+ COLOR_START, COLOR_PATH, COLOR_SPARK, COLOR_ROBOT, COLOR_ROBOT_OUTLINE) = range(len(PALETTE))
+
+# Pixels per board cell of exported frames
+EXPORT_SCALE = 40
+ROBOT_SIDE = 0.5
+
+
+def rasterize_board(map_, width, height):
+    """
+    Rasterizes board (color fields, walls and grid, as drawn by generate_map)
+    for exported frames. It isn't anti-aliased, so it only approximates the
+    color bitmaps of the maps (rasterized by inkscape) and must not replace
+    them: the color sensor reads those
+
+    :returns (height, width) array of PALETTE indices, rows are board y
+    """
+    board = np.array(map_["board"])
+    cells_x, cells_y = board.shape
+    # Board coordinates of pixel centres
+    xs = (np.arange(width) + 0.5) * cells_x / float(width)
+    ys = (np.arange(height) + 0.5) * cells_y / float(height)
+    cell_xs, cell_ys = xs.astype(int), ys.astype(int)
+
+    cells = np.zeros(board.shape, dtype=np.uint8)
+    for color, index in (("red", COLOR_RED), ("green", COLOR_GREEN), ("blue", COLOR_BLUE)):
+        for field in map_.get(color, []):
+            cells[field[0], field[1]] = index
+    cells[board == MAP_WALL] = COLOR_WALL
+    image = cells[cell_xs[np.newaxis, :], cell_ys[:, np.newaxis]]
+
+    # Grid lines (of width 0.1) between inner cells
+    half_width = 0.05
+    on_x_line = (abs(xs - np.round(xs)) <= half_width) & (np.round(xs) >= 2) & (np.round(xs) <= cells_x - 2)
+    on_y_line = (abs(ys - np.round(ys)) <= half_width) & (np.round(ys) >= 2) & (np.round(ys) <= cells_y - 2)
+    in_x_span = (xs >= 2 - half_width) & (xs <= cells_x - 2 + half_width)
+    in_y_span = (ys >= 2 - half_width) & (ys <= cells_y - 2 + half_width)
+    image[(on_x_line[np.newaxis, :] & in_y_span[:, np.newaxis]) |
+          (on_y_line[:, np.newaxis] & in_x_span[np.newaxis, :])] = COLOR_GRID
+    return image
+
+
+def to_rgb(image):
+    """ :returns RGB image (uint8 array) of PALETTE indices """
+    return np.array(PALETTE, dtype=np.uint8)[image]
+
+
+def _polyline_points(vertices, scale, spacing=0.5):
+    """ :returns pixel coordinates of points along the polyline (spacing in pixels) """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2) * scale
+    if len(vertices) < 2:
+        return vertices
+    deltas = vertices[1:] - vertices[:-1]
+    counts = np.ceil(np.hypot(deltas[:, 0], deltas[:, 1]) / spacing).astype(int) + 1
+    segments = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - starts[segments]) / np.maximum(counts - 1, 1)[segments].astype(np.float64)
+    return vertices[segments] + t[:, np.newaxis] * deltas[segments]
+
+
+def _stamp(image, points, color, radius):
+    """ Sets pixels within radius (in pixels) of the points """
+    if not len(points):
+        return
+    r = int(np.ceil(radius))
+    offsets = [(dx, dy) for dx in xrange(-r, r + 1) for dy in xrange(-r, r + 1)
+               if dx * dx + dy * dy <= max(radius * radius, 0.5)]
+    columns = np.floor(points[:, 0]).astype(int)
+    rows = np.floor(points[:, 1]).astype(int)
+    height, width = image.shape
+    for dx, dy in offsets:
+        x, y = columns + dx, rows + dy
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        image[y[inside], x[inside]] = color
+
+
+def _fill_polygon(image, vertices, color):
+    """ Fills convex polygon (vertices in pixels, in any order of winding) """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    height, width = image.shape
+    x0, y0 = np.maximum(np.floor(vertices.min(axis=0)).astype(int), 0)
+    x1 = min(int(np.ceil(vertices[:, 0].max())), width)
+    y1 = min(int(np.ceil(vertices[:, 1].max())), height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    xs, ys = np.meshgrid(np.arange(x0, x1) + 0.5, np.arange(y0, y1) + 0.5)
+    sides = []
+    for (ax, ay), (bx, by) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        sides.append((bx - ax) * (ys - ay) - (by - ay) * (xs - ax))
+    sides = np.array(sides)
+    inside = (sides >= 0).all(axis=0) | (sides <= 0).all(axis=0)
+    image[y0:y1, x0:x1][inside] = color
+
+
+class FrameRenderer(object):
+    """
+    Renders frames of a frame source (see ReplayPlayer.frame_state). The board
+    is rasterized once, path and sparks are drawn on its copy incrementally
+    (everything is redrawn only when going back) and the robot is drawn on
+    a copy of that for every frame
+    """
+
+    def __init__(self, frame_source, scale=EXPORT_SCALE):
+        self.frame_source = frame_source
+        self.scale = scale
+        board = frame_source.map["board"]
+        self.board = rasterize_board(frame_source.map, len(board) * scale, len(board[0]) * scale)
+        self._draw_start_position(self.board)
+        self.reset()
+
+    def reset(self):
+        self.canvas = self.board.copy()
+        self.path_length = 0
+        self.sparks_count = 0
+
+    def _draw_start_position(self, image):
+        x, y = self.frame_source.init_position[:2]
+        square = [(x - 0.3, y - 0.3), (x - 0.3, y + 0.3), (x + 0.3, y + 0.3),
+                  (x + 0.3, y - 0.3), (x - 0.3, y - 0.3)]
+        _stamp(image, _polyline_points(square, self.scale), COLOR_START, 0.05 * self.scale)
+
+    def _draw_spark(self, image, x, y):
+        arc = [(x + 0.25 * cos(i * pi / 4), y + 0.25 * sin(i * pi / 4)) for i in xrange(9)]
+        points = np.concatenate([_polyline_points([(x - 0.4, y), (x + 0.4, y)], self.scale),
+                                 _polyline_points([(x, y - 0.4), (x, y + 0.4)], self.scale),
+                                 _polyline_points(arc, self.scale)])
+        _stamp(image, points, COLOR_SPARK, 0.05 * self.scale)
+
+    def _draw_robot(self, image, position, orientation):
+        side = ROBOT_SIDE
+        angle = orientation + pi
+        vertices = [((position[0] + dx * cos(angle) - dy * sin(angle)) * self.scale,
+                     (position[1] + dx * sin(angle) + dy * cos(angle)) * self.scale)
+                    for dx, dy in ((side / 2.0, -side / 2.0), (side / 2.0, side / 2.0), (-side, 0))]
+        _fill_polygon(image, vertices, COLOR_ROBOT)
+        outline = np.array(vertices + vertices[:1]) / self.scale
+        _stamp(image, _polyline_points(outline, self.scale), COLOR_ROBOT_OUTLINE, 0.03 * self.scale)
+
+    def render(self, frame):
+        """ :returns (height, width) array of PALETTE indices """
+        position, orientation, path_length, sparks_count = self.frame_source.frame_state(frame)
+        if path_length < self.path_length or sparks_count < self.sparks_count:
+            self.reset()
+        if path_length > self.path_length:
+            # Last drawn vertex starts the new part of the path
+            vertices = self.frame_source.path[max(self.path_length - 1, 0):path_length]
+            _stamp(self.canvas, _polyline_points(vertices, self.scale), COLOR_PATH, 0.01 * self.scale)
+            self.path_length = path_length
+        for spark in self.frame_source.sparks[self.sparks_count:sparks_count]:
+            self._draw_spark(self.canvas, spark[0], spark[1])
+        self.sparks_count = sparks_count
+
+        image = self.canvas.copy()
+        self._draw_robot(image, position, orientation)
+        return image
+
+
+def _gif_image_blocks(image):
+    """
+    Encodes the image as GIF (with Image.save) and extracts its image
+    descriptor and data.
+
+    :returns (image descriptor fields (left, top, width, height, flags),
+        color table of the image, image data blocks)
+    """
+    buffer = io.BytesIO()
+    # Without optimization indices of the image are kept (as is its palette)
+    image.save(buffer, "GIF", optimize=False)
+    data = buffer.getvalue()
+
+    # Header, logical screen descriptor and (optional) global color table
+    flags = ord(data[10])
+    position = 13
+    color_table = b""
+    if flags & 0x80:
+        color_table = data[position:position + (3 << ((flags & 0x07) + 1))]
+        position += len(color_table)
+
+    # Extensions (graphic control, comments) preceding the image
+    while data[position] == b"!":
+        position += 2
+        while ord(data[position]):
+            position += ord(data[position]) + 1
+        position += 1
+    if data[position] != b",":
+        raise KrakrobotException("Unexpected GIF block " + repr(data[position]))
+
+    descriptor = struct.unpack("<HHHHB", data[position + 1:position + 10])
+    position += 10
+    if descriptor[4] & 0x80:
+        color_table = data[position:position + (3 << ((descriptor[4] & 0x07) + 1))]
+        position += len(color_table)
+    # Everything up to the trailer
+    return descriptor, color_table, data[position:data.rindex(b";")]
+
+
+class GifWriter(object):
+    """
+    Writes frames (arrays of PALETTE indices) to animated GIF one by one.
+    Only the part of the frame that changed since the previous one is written.
+
+    Frames are encoded by Pillow as separate GIF images, whose image blocks
+    are written to the animation. Image block gets its own (local) color
+    table if Pillow has stored the palette differently than in the global one
+    """
+
+    def __init__(self, file_name, duration, loop=0):
+        """
+        :param duration: duration of every frame in ms
+        """
+        self.file = open(file_name, "wb")
+        self.duration = duration
+        self.loop = loop
+        self.palette = bytearray(np.array(PALETTE + [(0, 0, 0)] * (256 - len(PALETTE)),
+                                          dtype=np.uint8).tostring())
+        self.previous = None
+
+    def _write_header(self, width, height):
+        # Logical screen with global color table of 256 colors, looped (NETSCAPE2.0 extension)
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xf7, 0, 0) + bytes(self.palette))
+        self.file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+    def write(self, frame):
+        offset = (0, 0)
+        if self.previous is None:
+            self._write_header(frame.shape[1], frame.shape[0])
+            image = Image.fromarray(frame, "P")
+        else:
+            changed = frame != self.previous
+            rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+            if len(rows):
+                offset = (columns[0], rows[0])
+                image = Image.fromarray(frame[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1], "P")
+            else:
+                image = Image.fromarray(frame[:1, :1], "P")
+        image.putpalette(self.palette)
+        self.previous = frame
+
+        (_, _, width, height, flags), color_table, image_data = _gif_image_blocks(image)
+        flags &= 0x78
+        if color_table and color_table != bytes(self.palette):
+            flags |= 0x80 | (len(color_table) // 3).bit_length() - 2
+        else:
+            color_table = b""
+        # Graphic control extension with the frame duration (in 1/100 s)
+        self.file.write(b"!\xf9\x04" + struct.pack("<BHB", 0, int(self.duration / 10), 0) + b"\x00")
+        # Image descriptor placed at offset
+        self.file.write(b"," + struct.pack("<HHHHB", offset[0], offset[1], width, height, flags))
+        self.file.write(color_table + image_data)
+
+    def close(self):
+        if self.previous is not None:
+            self.file.write(b";")
+        self.file.close()
+
+
+class PngSequenceWriter(object):
+    """ Writes frames (arrays of PALETTE indices) to numbered PNG files """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.count = 0
+        self.palette = np.array(PALETTE, dtype=np.uint8).flatten().tolist()
+
+    def write(self, frame):
+        image = Image.fromarray(frame, "P")
+        image.putpalette(self.palette)
+        image.save(os.path.join(self.directory, "frame_{0:05d}.png".format(self.count)))
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+def export_replay(replay_file, output, frame_dt=None, scale=EXPORT_SCALE, frame_step=1):
+    """
+    Exports frames of the replay to animated GIF (if output ends with .gif)
+    or to PNG files in the output directory
+
+    :param frame_step: only every frame_step-th frame is exported
+    :returns number of exported frames
+    """
+    player = ReplayPlayer(replay_file, frame_dt)
+    renderer = FrameRenderer(player, scale)
+    if output.lower().endswith(".gif"):
+        writer = GifWriter(output, duration=int(round(1000 * player.frame_dt * frame_step)))
+    else:
+        writer = PngSequenceWriter(output)
+    frames = range(0, player.frame_count(), frame_step)
+    try:
+        for frame in frames:
+            writer.write(renderer.render(frame))
+    finally:
+        writer.close()
+    return len(frames)
@@ -274,6 +274,8 @@ if __name__ == "__main__":
     svg_file = open(svg_output_file, "w")
     svg_file.write(RenderFrameTemplate({"Map": map_}))
     svg_file.close()
+    # Color sensor reads this bitmap, so it is rasterized (anti-aliased) by
+    # inkscape as the shipped maps are, not by export.rasterize_board
     print "Successfully generated SVG file '{}'. Converting to PNG '{}' now...".format(svg_output_file, png_output_file)
     res = os.system("inkscape -z -e {} -w 512 -h 512 {}".format(png_output_file, svg_output_file))
     if res != 0:
@@ -3,13 +3,16 @@
 import os
 import sys
 import pprint
+from math import cos, sin, pi
+from Queue import Empty
 
 from PyQt4 import QtGui, QtCore, QtSvg
 from PyQt4.QtGui import QPixmap, QApplication
 from simulator import KrakrobotSimulator
 from robot_controller import construct_cmd_robot
-from misc.visualisation import PrepareFrame, RenderAnimatedPart, \
-    RenderFrameTemplate, fill_visualisation_descriptor
+from replay import ReplayPlayer
+from misc.visualisation import PrepareFrame, RenderFrameTemplate, \
+    IncrementalPath, fill_visualisation_descriptor, BOARD_TRANSFORM
 from misc.defines import __version__, __about__, __authors__, __license__
 from misc.defines import *
 
@@ -21,6 +24,15 @@ APP_FULL_NAME = APP_NAME + ' ' + __version__
 MSG_EMP = '-> '
 
 DEFAULT_ANIMATION_RATE = 10
+ROBOT_SIDE = 0.5
+# Displayed path is simplified (no vertex is farther than this from it)
+PATH_TOLERANCE = 0.01
+# Frames are handed to the GUI in batches of at most FRAME_BATCH_SIZE frames,
+# FrameWorker waits when FRAME_BATCHES_PENDING batches were not handled yet
+FRAME_BATCH_SIZE = 500
+FRAME_BATCHES_PENDING = 2
+# How long (s) FrameWorker waits for frames before checking if it should stop
+FRAME_POLL_INTERVAL = 0.1
 
 
 class SimulationThread(QtCore.QThread):
@@ -37,6 +49,122 @@ class SimulationThread(QtCore.QThread):
         print "Simulation has finished. Results:\n{0}".format(pprint.pformat(results, indent=1))
 
 
+def add_spark_shape(painter_path, x, y):
+    """Adds spark (cross in a circle, as drawn by RenderAnimatedPart)"""
+    painter_path.moveTo(x - 0.4, y)
+    painter_path.lineTo(x + 0.4, y)
+    painter_path.moveTo(x, y - 0.4)
+    painter_path.lineTo(x, y + 0.4)
+    painter_path.moveTo(x + 0.25, y)
+    for i in range(1, 9):
+        painter_path.lineTo(x + 0.25 * cos(i * pi / 4), y + 0.25 * sin(i * pi / 4))
+
+
+def frame_descriptor(frame_source, frame):
+    """Descriptor of the frame ready for visualisation"""
+    sim_data = frame_source.frame(frame)
+    fill_visualisation_descriptor(sim_data)
+    return sim_data
+
+
+class LiveFrameSource(object):
+    """Frames of the running simulation (reconstructed from frame deltas)
+
+    Path and sparks are shared by all the frames, so only pose and lengths
+    of path and sparks are kept for every frame
+
+    """
+
+    def __init__(self):
+        self.path = []
+        self.sparks = []
+        self.states = []
+        self.map = None
+        self.start_pos = None
+
+    def add(self, sim_data):
+        self.path.extend(sim_data['NewPath'])
+        self.sparks.extend(sim_data['NewSparks'])
+        self.map = sim_data['Map']
+        self.start_pos = sim_data['StartPos']
+        self.states.append((sim_data['ActualPosition'], sim_data['ActualOrientation'],
+                            len(self.path), len(self.sparks)))
+
+    def frame_count(self):
+        return len(self.states)
+
+    def frame_state(self, frame):
+        return self.states[frame]
+
+    def frame(self, frame):
+        position, orientation, path_length, sparks_count = self.states[frame]
+        return {
+            'ActualPath': self.path[:path_length],
+            'Sparks': self.sparks[:sparks_count],
+            'ActualPosition': position,
+            'ActualOrientation': orientation,
+            'Map': self.map,
+            'StartPos': self.start_pos
+        }
+
+
+class FrameWorker(QtCore.QThread):
+    """Collects frames of the running simulation in the background
+
+    Frames are drained from the simulator into LiveFrameSource (frame
+    template is rendered with the first frame) and frames_ready is emitted
+    for every batch. Worker waits when the GUI does not keep up with handling
+    the batches (see batch_done), so the simulator waits on its full queue
+
+    """
+
+    # Number of available frames and frame template (None if already sent)
+    frames_ready = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, simulator, frame_source, parent=None):
+        super(FrameWorker, self).__init__(parent)
+        self.simulator = simulator
+        self.frame_source = frame_source
+        self.pending_batches = QtCore.QSemaphore(FRAME_BATCHES_PENDING)
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        self.wait()
+
+    def batch_done(self):
+        """Should be called by the GUI after handling frames_ready"""
+        self.pending_batches.release()
+
+    def run(self):
+        frame_template = None
+        while not self.stopped:
+            try:
+                sim_data = self.simulator.get_next_frame(FRAME_POLL_INTERVAL)
+            except Empty:
+                if self.simulator.finished and self.simulator.sim_frames.empty():
+                    return
+                continue
+
+            self.frame_source.add(sim_data)
+            for _ in xrange(FRAME_BATCH_SIZE - 1):
+                try:
+                    self.frame_source.add(self.simulator.get_next_frame_nowait())
+                except Empty:
+                    break
+
+            if frame_template is None:
+                frame_template = RenderFrameTemplate(frame_descriptor(self.frame_source, 0))
+                new_template = frame_template
+            else:
+                new_template = None
+
+            while not self.pending_batches.tryAcquire(1, int(FRAME_POLL_INTERVAL * 1000)):
+                if self.stopped:
+                    return
+            self.frames_ready.emit(self.frame_source.frame_count(), new_template)
+
+
 class KrakrobotBoardAnimation(QtGui.QGraphicsView):
     """KrakrobotSimulator board animation painting widget"""
 
@@ -48,7 +176,11 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
     # NOTE: Ths value is being incremented when when refresh_rate is too small
     animation_speed = 1
     frame_template = ''
-    frames = []
+    # LiveFrameSource or ReplayPlayer, frames are shown by updating items
+    # of the robot, path and sparks (the board is rendered once)
+    frame_source = None
+    frame_worker = None
+    robot_item = None
     current_frame = 0
     frame_count = 0
     simulator = None
@@ -61,8 +193,6 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
         self.simulator = simulator
 
     def init_ui(self):
-        self.frames_timer = QtCore.QTimer(self)
-        self.frames_timer.timeout.connect(self.frames_update)
         self.animation_timer = QtCore.QTimer(self)
         self.animation_timer.timeout.connect(self.animation_update)
 
@@ -78,22 +208,109 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
         scene = self.scene()
         scene.clear()
         self.resetTransform()
+        self.robot_item = None
 
-        self.xml_stream_reader = QtCore.QXmlStreamReader()
-        if self.frame_template:
-            self.xml_stream_reader = QtCore.QXmlStreamReader(self.frame_template)
-
-        self.svg_renderer = QtSvg.QSvgRenderer(self.xml_stream_reader)
+        # Static part of the frame is rendered once and cached
+        self.svg_renderer = QtSvg.QSvgRenderer(QtCore.QByteArray(
+            PrepareFrame(self.frame_template, ['', '', '']) if self.frame_template else ''))
         self.svg_item = QtSvg.QGraphicsSvgItem()
         self.svg_item.setSharedRenderer(self.svg_renderer)
         self.svg_item.setFlags(QtGui.QGraphicsItem.ItemClipsToShape)
-        self.svg_item.setCacheMode(QtGui.QGraphicsItem.NoCache)
+        self.svg_item.setCacheMode(QtGui.QGraphicsItem.DeviceCoordinateCache)
         self.svg_item.setZValue(0)
 
         scene.addItem(self.svg_item)
 
         scene.setSceneRect(self.svg_item.boundingRect().adjusted(-10, -10, 10, 10))
 
+        if self.frame_template:
+            self._create_board_items()
+
+    def _create_board_items(self):
+        """Create items of the robot, path and sparks (in board coordinates)"""
+
+        view_box = self.svg_renderer.viewBoxF()
+        scale = self.svg_renderer.defaultSize().width() / view_box.width()
+        m11, m12, m21, m22, dx, dy = BOARD_TRANSFORM
+        self.board_item = QtGui.QGraphicsRectItem()
+        self.board_item.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        self.board_item.setTransform(QtGui.QTransform(
+            m11 * scale, m12 * scale, m21 * scale, m22 * scale,
+            (dx - view_box.x()) * scale, (dy - view_box.y()) * scale))
+        self.board_item.setZValue(1)
+        self.scene().addItem(self.board_item)
+
+        side = ROBOT_SIDE
+        self.robot_item = QtGui.QGraphicsPolygonItem(QtGui.QPolygonF([
+            QtCore.QPointF(side / 2.0, -side / 2.0),
+            QtCore.QPointF(side / 2.0, side / 2.0),
+            QtCore.QPointF(-side, 0)]), self.board_item)
+        self.robot_item.setPen(QtGui.QPen(QtGui.QColor('purple'), 0.06))
+        self.robot_item.setBrush(QtGui.QBrush(QtGui.QColor('lime')))
+        self.robot_item.setZValue(1)
+
+        self.sparks_item = QtGui.QGraphicsPathItem(self.board_item)
+        pen = QtGui.QPen(QtGui.QColor('#d00'), 0.1)
+        pen.setCapStyle(QtCore.Qt.FlatCap)
+        self.sparks_item.setPen(pen)
+        self.sparks_item.setZValue(2)
+
+        # Committed part of the simplified path only grows, its tail is
+        # redrawn every frame
+        self.path_item = QtGui.QGraphicsPathItem(self.board_item)
+        self.path_item.setPen(QtGui.QPen(QtGui.QColor('#40f'), 0.02))
+        self.path_item.setZValue(3)
+        self.path_tail_item = QtGui.QGraphicsPathItem(self.board_item)
+        self.path_tail_item.setPen(self.path_item.pen())
+        self.path_tail_item.setZValue(3)
+
+        self.path = IncrementalPath(PATH_TOLERANCE)
+        self.painter_path = QtGui.QPainterPath()
+        self.path_committed = 0
+        self.sparks_path = QtGui.QPainterPath()
+        self.sparks_count = 0
+
+    def _show_frame(self, frame):
+        """Update items of the robot, path and sparks to the given frame"""
+
+        position, orientation, path_length, sparks_count = self.frame_source.frame_state(frame)
+        self.robot_item.setPos(position[0], position[1])
+        self.robot_item.setRotation(orientation * 180 / pi + 180.0)
+
+        # Path and sparks only grow during playback, they are rebuilt when
+        # going back
+        if path_length < self.path.count:
+            self.painter_path = QtGui.QPainterPath()
+            self.path_committed = 0
+        if path_length != self.path.count:
+            path = self.frame_source.path
+            self.path.update(path, path_length)
+            if self.path.committed > self.path_committed:
+                for x, y in self.path.vertices(path, self.path_committed)[:self.path.committed - self.path_committed]:
+                    if self.painter_path.elementCount() == 0:
+                        self.painter_path.moveTo(x, y)
+                    else:
+                        self.painter_path.lineTo(x, y)
+                self.path_committed = self.path.committed
+                self.path_item.setPath(self.painter_path)
+
+            tail_path = QtGui.QPainterPath()
+            for i, (x, y) in enumerate(self.path.vertices(path, max(self.path.committed - 1, 0))):
+                if i == 0:
+                    tail_path.moveTo(x, y)
+                else:
+                    tail_path.lineTo(x, y)
+            self.path_tail_item.setPath(tail_path)
+
+        if sparks_count < self.sparks_count:
+            self.sparks_path = QtGui.QPainterPath()
+            self.sparks_count = 0
+        if sparks_count > self.sparks_count:
+            for spark in self.frame_source.sparks[self.sparks_count:sparks_count]:
+                add_spark_shape(self.sparks_path, spark[0], spark[1])
+            self.sparks_count = sparks_count
+            self.sparks_item.setPath(self.sparks_path)
+
     def start(self):
         """Start simulation process"""
 
@@ -101,22 +318,35 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
             return
 
         self.animation_started = True
+        self._stop_frame_worker()
         self.frame_template = ''
-        self.frames = []
         self.current_frame = 0
         self.frame_count = 0
         self.animation_started = True
         self.animation_paused = False
 
+        replay = isinstance(self.simulator, ReplayPlayer)
+        if replay:
+            # All frames are available at once
+            self.frame_source = self.simulator
+            self.frame_count = self.frame_source.frame_count()
+            self.frame_template = RenderFrameTemplate(self._frame_data(0))
+            self.parent().parent().update_frame_count(self.frame_count)
+        else:
+            self.frame_source = LiveFrameSource()
+
         self.simulation_thread = SimulationThread()
         self.simulation_thread.finished.connect(self.parent().parent().simulation_finished)
         self.clear_board()
         self.simulation_thread.set_simulator(self.simulator)
         self.simulation_thread.start()
 
-        self.status_bar_message.emit('Simulation started...')
+        self.status_bar_message.emit('Replay started...' if replay else 'Simulation started...')
 
-        self.frames_timer.start(0)
+        if not replay:
+            self.frame_worker = FrameWorker(self.simulator, self.frame_source, self)
+            self.frame_worker.frames_ready.connect(self.frames_update)
+            self.frame_worker.start()
         self.animation_timer.start(self.refresh_rate)
 
     def pause_animation(self):
@@ -139,36 +369,37 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
         if self.simulation_thread:
             self.simulation_thread.terminate()
         self.simulator.terminate()
-        self.frames_timer.stop()
+        self._stop_frame_worker()
 
-    def frames_update(self):
-        """Update collection and GUI with current simulator frames data
+    def _stop_frame_worker(self):
+        if self.frame_worker:
+            self.frame_worker.stop()
+            self.frame_worker = None
 
-        This method is an event of self.frames_timer timeout
+    def frames_update(self, frame_count, frame_template):
+        """Update GUI with frames collected by the frame worker
+
+        This method is an event of self.frame_worker frames_ready signal
 
         """
 
-        if self.simulator:
+        if self.sender() is not self.frame_worker:
+            return
 
-            try:
-                sim_data = self.simulator.get_next_frame_nowait()
-            except Exception:
-                if self.simulator.finished:
-                    self.frames_timer.stop()
-                return
-            fill_visualisation_descriptor(sim_data)
+        if frame_template is not None:
+            self.frame_template = frame_template
+            self.clear_board()
 
-            if self.frame_template == '':
-                self.frame_template = RenderFrameTemplate(sim_data)
-                self.clear_board()
+        self.frame_count = frame_count
 
-            svg_data = RenderAnimatedPart(sim_data)
-            self.frames.append(svg_data)
-            self.frame_count += 1
+        # GUI update #
+        main_window = self.parent().parent()
+        main_window.update_frame_count(self.frame_count)
+        self.frame_worker.batch_done()
 
-            # GUI update #
-            main_window = self.parent().parent()
-            main_window.update_frame_count(self.frame_count)
+    def _frame_data(self, frame):
+        """Descriptor of the frame ready for visualisation"""
+        return frame_descriptor(self.frame_source, frame)
 
     def animation_update(self):
         """Update GUI with current animation frame
@@ -177,22 +408,11 @@ class KrakrobotBoardAnimation(QtGui.QGraphicsView):
 
         """
 
-        if len(self.frames) > 0:
+        if self.frame_count > 0 and self.robot_item is not None:
             if self.current_frame + 1 > self.frame_count:
                 return
-            svg_data = PrepareFrame(self.frame_template, self.frames[self.current_frame])
-            self.xml_stream_reader.clear()
-            self.xml_stream_reader.addData(svg_data)
-            self.svg_renderer.load(self.xml_stream_reader)
-
-            scene = self.scene()
-            self.svg_item.setSharedRenderer(self.svg_renderer)
-            self.svg_item.setFlags(QtGui.QGraphicsItem.ItemClipsToShape)
-            self.svg_item.setCacheMode(QtGui.QGraphicsItem.NoCache)
-            self.svg_item.setZValue(0)
-            scene.update()
-
-            scene.setSceneRect(self.svg_item.boundingRect().adjusted(-10, -10, 10, 10))
+            self._show_frame(self.current_frame)
+            self.viewport().update()
 
 
             # GUI update #
@@ -427,6 +647,11 @@ class MainWindow(QtGui.QMainWindow):
         self.open_source_action.triggered.connect(self.open_source)
         self.menuBar().addMenu(robot_menu)
 
+        replay_menu = QtGui.QMenu('Re&play', self)
+        self.open_replay_action = replay_menu.addAction('&Open replay file...')
+        self.open_replay_action.triggered.connect(self.open_replay)
+        self.menuBar().addMenu(replay_menu)
+
         # widgets_menu = QtGui.QMenu('&Widgets', self)
         # self.console_action = widgets_menu.addAction(
             # self.console_dock_widget.toggleViewAction()
@@ -447,6 +672,7 @@ class MainWindow(QtGui.QMainWindow):
         # Actions that we need to disable when simulating
         self.conflicting_with_sim = [
             self.start_sim_action,
+            self.open_replay_action,
             self.steering_noise_edit,
             self.distance_noise_edit,
             self.fsteering_noise_edit,
@@ -518,6 +744,24 @@ class MainWindow(QtGui.QMainWindow):
             'Robot source code loaded from ' + str(file_name)
         )
 
+    def open_replay(self):
+
+        file_name = QtGui.QFileDialog.getOpenFileName(
+            self, 'Open replay file...', '.',
+            'Krakrobot replays (*.replay);;Any file (*)'
+        )
+        try:
+            player = ReplayPlayer(str(file_name), self.simulator_params['frame_dt'])
+        except Exception as error:
+            self.status_bar_message(
+                MSG_EMP + 'Replay file opening error: ' + str(error)
+            )
+            return -1
+        self.status_bar_message(
+            'Replay opened from ' + str(file_name)
+        )
+        self._run_replay(player)
+
     def about_window(self):
         QtGui.QMessageBox.about(
             self,
@@ -593,6 +837,21 @@ class MainWindow(QtGui.QMainWindow):
         self.board_animation.start()
         self.console_timer.start(1)
 
+    def _run_replay(self, player):
+        """Show recorded run (frames are read instead of being simulated)"""
+        self.currently_simulating = True
+        self._play_progress_animation()
+        for action in self.conflicting_with_sim:
+            action.setEnabled(False)
+        self.simulator = player
+        self.board_animation.new_simulator(self.simulator)
+        self.board_animation.start()
+
+        for new_line in player.get_logs():
+            line_dict = eval(new_line.split(':\n')[0])
+            self.console_dict[line_dict['frame']] = new_line
+            self.output_console.append(new_line)
+
     def _terminate_simulation(self):
         self.board_animation.terminate_simulation()
         self.currently_simulating = False
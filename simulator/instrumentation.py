@@ -0,0 +1,54 @@
+""" Counters and progress snapshots of the simulation """
+
+import json
+import time
+
+from misc.defines import *
+
+
+class SimulationStats(object):
+    """
+    Counters of the simulation written as JSON lines (progress snapshots
+    every interval iterations of the simulation loop and the final one).
+
+    Only commands and color readings are counted here (once per command),
+    ticks and collisions are taken from the recorders of the simulator when
+    a snapshot is taken. Without a stream nothing is written and the loop
+    only compares iteration with next_snapshot (which is infinite then)
+    """
+
+    def __init__(self, stream=None, interval=1000):
+        self.stream = stream
+        self.interval = interval
+        self.commands = {}
+        self.color_readings = 0
+        self.start_time = time.time()
+        self.next_snapshot = 0 if stream is not None else float("inf")
+
+    def count_command(self, name):
+        self.commands[name] = self.commands.get(name, 0) + 1
+
+    def counters(self, ticks, collisions, frames):
+        """ :returns dict of all the counters """
+        return {
+            "ticks": ticks,
+            "collisions": collisions,
+            "frames": frames,
+            "commands": sum(self.commands.itervalues()),
+            "commands_by_type": dict(self.commands),
+            "sensor_readings": {
+                "color": self.color_readings,
+                "sonar": self.commands.get(SENSE_SONAR, 0),
+                "gps": self.commands.get(SENSE_GPS, 0),
+            },
+        }
+
+    def snapshot(self, event, iteration, sim_time, counters):
+        """ Writes snapshot (if enabled) and schedules the next progress one """
+        if self.stream is None:
+            return
+        record = {"event": event, "iteration": iteration, "sim_time": sim_time,
+                  "wall_time": time.time() - self.start_time}
+        record.update(counters)
+        self.stream.write(json.dumps(record) + "\n")
+        self.next_snapshot = iteration + self.interval
@@ -15,12 +15,15 @@
 
 from optparse import OptionParser
 from simulator import KrakrobotSimulator
-from robot_controller import compile_robot, construct_cmd_robot
+from robot_controller import compile_robot, construct_cmd_robot, construct_python_robot, build_robot
+from misc.defines import *
 import sys
 import json
 import pprint
 import os
 import signal
+import tempfile
+import logging
 
 # TODO: pass constants to robot
 
@@ -59,6 +62,30 @@ def create_parser():
         default=None,
         help="Name of file to output results to"
     )
+    parser.add_option(
+        "--trajectory_file",
+        dest="trajectory_file",
+        type="str",
+        default=None,
+        help="Name of .npz file to save full trajectory (pose after every"
+             " tick), collisions and beeps to"
+    )
+    parser.add_option(
+        "--replay",
+        dest="replay",
+        type="str",
+        default=None,
+        help="Name of replay file to save the run to (can be opened in the GUI"
+             " without running the robot again)"
+    )
+    parser.add_option(
+        "--export",
+        dest="export",
+        type="str",
+        default=None,
+        help="Name of animated .gif file (or directory for .png files) to"
+             " export frames of the run to"
+    )
     parser.add_option(
         "-r",
         "--robot",
@@ -66,6 +93,30 @@ def create_parser():
         default="python2.7 " + os.path.join(os.path.dirname(__file__), "../examples/python/run.py"),
         help="Robot that will be compiled and run"
     )
+    parser.add_option(
+        "--build",
+        dest="build",
+        action="store_true",
+        default=False,
+        help="Treat --robot as a directory of sources (with Makefile or .java"
+             " files) and run the bot built from them, building it only if"
+             " it isn't in the build cache yet"
+    )
+    parser.add_option(
+        "--build_cache_dir",
+        dest="build_cache_dir",
+        type="str",
+        default=BUILD_CACHE_DIR,
+        help="Directory of the build cache (see --build)"
+    )
+    parser.add_option(
+        "--in_process",
+        dest="in_process",
+        action="store_true",
+        default=False,
+        help="Treat --robot as a Python file with the bot class and run it"
+             " in the simulator process (without pipes)"
+    )
     parser.add_option(
         "--steering_noise",
         dest="steering_noise",
@@ -129,12 +180,43 @@ def create_parser():
         help="How often (number of ticks of simulator) to report simulation"
              " status"
     )
+    parser.add_option(
+        "--stats_file",
+        dest="stats_file",
+        type="str",
+        default=None,
+        help="Name of file to write counters of the simulation (ticks,"
+             " collisions, commands, sensor readings) to as JSON lines"
+    )
+    parser.add_option(
+        "--no_macro_step",
+        dest="macro_step",
+        action="store_false",
+        default=True,
+        help="Execute MOVE and TURN commands tick by tick instead of in one"
+             " vectorized batch (command line mode only, results are the same)"
+    )
+    parser.add_option(
+        "--no_sonar_table",
+        dest="sonar_table",
+        action="store_false",
+        default=True,
+        help="Cast a ray for every sonar reading instead of using distances"
+             " precomputed for the map (results are the same)"
+    )
     return parser
 
 
 parser = create_parser()
 (options, args) = parser.parse_args()
 
+if options.in_process:
+    robot_controller = construct_python_robot(options.robot)
+elif options.build:
+    robot_controller = construct_cmd_robot(build_robot(options.robot, options.build_cache_dir))
+else:
+    robot_controller = construct_cmd_robot(options.robot)
+
 simulator_params = {
                         "seed": options.seed,
                         # Robot parameters
@@ -150,8 +232,12 @@ simulator_params = {
                         "simulation_time_limit": options.simulation_time_limit,
                         "frame_dt": options.frame_dt,
                         "iteration_write_frequency": options.iteration_write_frequency,
+                        "macro_step": options.macro_step,
+                        "sonar_table": options.sonar_table,
+                        "stats_file": options.stats_file,
+                        "print_logger": True,
 
-                        "robot_controller":  construct_cmd_robot(options.robot), #compile_robot(options.robot)[0],
+                        "robot_controller":  robot_controller,
                         "map": options.map,
 
                         # Krakrobot 2015 task doesn't allow for using GPS or sonar
@@ -165,6 +251,8 @@ sim_gui = None
 
 def main():
     global sim_gui
+    logging.basicConfig(level=logging.INFO,
+                        format='%(funcName)s - %(asctime)s - %(levelname)s - %(message)s')
     if options.command_line:
         simulator = KrakrobotSimulator(simulation_dt=0.0, **simulator_params)
         print "Running simulator"
@@ -183,6 +271,28 @@ def main():
         with open(options.output, "w") as f:
             f.write(json.dumps(simulator.get_results()))
 
+    if results and options.trajectory_file:
+        print "Writing trajectory to ", options.trajectory_file
+        simulator.save_trajectory(options.trajectory_file)
+
+    if results and options.replay:
+        print "Writing replay to ", options.replay
+        simulator.save_replay(options.replay)
+
+    if results and options.export:
+        print "Exporting frames to ", options.export
+        from export import export_replay
+        if options.replay:
+            export_replay(options.replay, options.export)
+        else:
+            replay_fd, replay_file = tempfile.mkstemp(suffix=".replay")
+            os.close(replay_fd)
+            try:
+                simulator.save_replay(replay_file)
+                export_replay(replay_file, options.export)
+            finally:
+                os.remove(replay_file)
+
 def close_gracefully(signal, frame):
     if sim_gui:
         sim_gui.close()
@@ -6,21 +6,275 @@ import scipy
 import os
 import numpy as np
 import copy
+import array
+from collections import OrderedDict
+from math import cos, sin, floor, pi
 
 from misc.defines import *
 from scipy.ndimage.io import imread
 
+def get_color_table(map_):
+    """
+    :returns color lookup table of the map (built on first use and kept in
+        the map): scales from board to bitmap coordinates, RGB bitmap and its
+        rows as bytearrays (for fast scalar lookups)
+    """
+    if "color_table" not in map_:
+        bitmap = map_['color_bitmap']
+        rgb = np.ascontiguousarray(bitmap[:, :, 0:3], dtype=np.uint8)
+        rgb.setflags(write=False)
+        map_["color_table"] = {
+            "x_scale": bitmap.shape[1] / float(map_['N']),
+            "y_scale": bitmap.shape[0] / float(map_['M']),
+            "rgb": rgb,
+            "rows": [bytearray(row.tostring()) for row in rgb]
+        }
+    return map_["color_table"]
+
+def _round_half_even(value):
+    """ Same as np.round for a scalar, returns int """
+    whole = floor(value)
+    fraction = value - whole
+    if fraction > 0.5 or (fraction == 0.5 and whole % 2 == 1):
+        whole += 1
+    return int(whole)
+
 def get_color(map_, x, y):
     """
-    :returns closest (calculated by round) pixel from bitmap as extrapolated using map_width and map_height
+    :returns closest (calculated by round) pixel from bitmap as extrapolated
+        using map_width and map_height, as (r, g, b) tuple
+    """
+    table = get_color_table(map_)
+    row = table["rows"][_round_half_even(table["y_scale"] * y)]
+    i = 3 * _round_half_even(table["x_scale"] * x)
+    return row[i], row[i + 1], row[i + 2]
+
+def get_colors(map_, xs, ys):
+    """
+    Vectorized get_color
+
+    :returns (n, 3) uint8 array of colors at points (xs[i], ys[i])
+    """
+    table = get_color_table(map_)
+    rows = np.round(table["y_scale"] * np.asarray(ys, dtype=np.float64)).astype(int)
+    columns = np.round(table["x_scale"] * np.asarray(xs, dtype=np.float64)).astype(int)
+    return table["rgb"][rows, columns]
+
+def cast_ray(grid, x, y, orientation):
+    """
+    Traverses grid cells along the ray (Amanatides-Woo) until the first wall.
+    Cell (i, j) covers [i, i + 1) x [j, j + 1).
+
+    :returns distance from (x, y) to the first wall along the ray
     """
-    # x = float(x/map_['N']) * map_['color_bitmap'].shape[0]
-    # y = float(y/map_['M']) * map_['color_bitmap'].shape[1]
-    #
-    #
-    y = np.round(map_['color_bitmap'].shape[0] / float(map_['M']) * y)
-    x = np.round(map_['color_bitmap'].shape[1] / float(map_['N']) * x)
-    return map_['color_bitmap'][y, x][0:3]
+    dx, dy = cos(orientation), sin(orientation)
+    cx, cy = int(floor(x)), int(floor(y))
+    if grid[cx][cy] == MAP_WALL:
+        return 0.0
+
+    step_x = 1 if dx > 0 else -1
+    step_y = 1 if dy > 0 else -1
+    n, m = len(grid), len(grid[0])
+    while True:
+        # Distances to the next vertical and horizontal cell boundary
+        tx = (cx + (step_x > 0) - x) / dx if dx != 0 else float("inf")
+        ty = (cy + (step_y > 0) - y) / dy if dy != 0 else float("inf")
+        if tx < ty:
+            cx, t = cx + step_x, tx
+        else:
+            cy, t = cy + step_y, ty
+
+        if not (0 <= cx < n and 0 <= cy < m):
+            raise KrakrobotException("Ray has left the board without hitting a wall. Note: boundary should be walled")
+        if grid[cx][cy] == MAP_WALL:
+            return t
+
+def _traverse_rays(grid, xs, ys, orientations):
+    """
+    Traverses all rays cell by cell in lockstep (see cast_ray)
+
+    :returns distances, wall cell coordinates (cx, cy), mask of rays that hit
+        a vertical face (x = const) and mask of rays that left the board
+    """
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    orientations = np.asarray(orientations, dtype=np.float64)
+    dx, dy = np.cos(orientations), np.sin(orientations)
+    cx, cy = np.floor(xs).astype(int), np.floor(ys).astype(int)
+    step_x = np.where(dx > 0, 1, -1)
+    step_y = np.where(dy > 0, 1, -1)
+    # Coordinates of the next cell boundaries crossed by the rays
+    next_x, next_y = cx + (step_x > 0), cy + (step_y > 0)
+
+    distances = np.zeros(len(xs))
+    vertical = np.zeros(len(xs), dtype=bool)
+    escaped = np.zeros(len(xs), dtype=bool)
+    # Only rays still traversing the board are processed in every step
+    active = np.nonzero(grid[cx, cy] != MAP_WALL)[0]
+    n, m = grid.shape
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while len(active):
+            tx = np.where(dx[active] != 0, (next_x[active] - xs[active]) / dx[active], np.inf)
+            ty = np.where(dy[active] != 0, (next_y[active] - ys[active]) / dy[active], np.inf)
+            move_x = tx < ty
+            cx[active] += np.where(move_x, step_x[active], 0)
+            cy[active] += np.where(move_x, 0, step_y[active])
+            next_x[active] += np.where(move_x, step_x[active], 0)
+            next_y[active] += np.where(move_x, 0, step_y[active])
+
+            ax, ay = cx[active], cy[active]
+            outside = (ax < 0) | (ax >= n) | (ay < 0) | (ay >= m)
+            escaped[active[outside]] = True
+
+            hit = ~outside & (grid[ax.clip(0, n - 1), ay.clip(0, m - 1)] == MAP_WALL)
+            distances[active[hit]] = np.where(move_x, tx, ty)[hit]
+            vertical[active[hit]] = move_x[hit]
+            active = active[~outside & ~hit]
+
+    return distances, cx, cy, vertical, escaped
+
+def cast_rays(grid, xs, ys, orientations):
+    """
+    Vectorized version of cast_ray answering many queries at once (all rays
+    are traversed cell by cell in lockstep).
+
+    :returns numpy array of distances to the first wall
+    """
+    distances, _, _, _, escaped = _traverse_rays(np.asarray(grid), xs, ys, orientations)
+    if escaped.any():
+        raise KrakrobotException("Ray has left the board without hitting a wall. Note: boundary should be walled")
+    return distances
+
+def _stable_faces(walls, c_normal, c_across, size, face, step, d_normal_0, d_across_0, d_normal_1, d_across_1):
+    """
+    Checks (for the vertical faces, pass transposed data for the horizontal
+    ones) that every ray starting in square [c_normal, c_normal + size] x
+    [c_across, c_across + size] with heading between the two given directions
+    hits the face line normal = face.
+
+    Rays sweep the convex hull of the square and of the 8 hits of the extreme
+    rays (square corners x bin edges) with the face line. Face is stable if
+    bounding box of the hull contains no wall before the face line and there
+    are only walls just behind the face line.
+
+    :param walls: 2D prefix sums of walls, indexed [normal, across]
+    """
+    eps = 1e-9
+    n, m = walls.shape[0] - 1, walls.shape[1] - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hits = []
+        for d_normal, d_across in ((d_normal_0, d_across_0), (d_normal_1, d_across_1)):
+            for corner_normal in (c_normal, c_normal + size):
+                for corner_across in (c_across, c_across + size):
+                    hits.append(corner_across + (face - corner_normal) * d_across / d_normal)
+    hits = np.array(hits)
+    stable = (np.sign(d_normal_0) == step) & (np.sign(d_normal_1) == step) & np.isfinite(hits).all(axis=0)
+    hits = np.where(stable, hits, c_across)
+    cell_normal, cell_across = np.floor(c_normal).astype(int), np.floor(c_across).astype(int)
+    lo = np.floor(hits.min(axis=0) - eps).astype(int)
+    hi = np.floor(hits.max(axis=0) + eps).astype(int)
+    before_lo = np.minimum(cell_across, lo)
+    before_hi = np.maximum(cell_across, hi)
+    behind = np.where(step > 0, face, face - 1)
+    first, last = np.where(step > 0, cell_normal, face), np.where(step > 0, face - 1, cell_normal)
+    stable &= (before_lo >= 0) & (before_hi < m) & (behind >= 0) & (behind < n) & (first <= last)
+
+    def count(i0, i1, j0, j1):
+        i0, i1 = i0.clip(0, n - 1), i1.clip(0, n - 1)
+        j0, j1 = j0.clip(0, m - 1), j1.clip(0, m - 1)
+        return walls[i1 + 1, j1 + 1] - walls[i0, j1 + 1] - walls[i1 + 1, j0] + walls[i0, j0]
+
+    stable &= count(first, last, before_lo, before_hi) == 0
+    stable &= count(behind, behind, lo, hi) == hi - lo + 1
+    return stable
+
+def _sonar_table_faces(grid, walls, sx, sy, b, subdivision, bin_width):
+    """ :returns faces (see build_sonar_table) of squares sx, sy for heading bins b """
+    size = 1.0 / subdivision
+    faces = np.full(len(b), np.nan)
+
+    # Candidate face is the one hit by the ray from the square center
+    free = np.nonzero(grid[sx // subdivision, sy // subdivision] != MAP_WALL)[0]
+    x0, y0 = sx[free] * size, sy[free] * size
+    headings = (b[free] + 0.5) * bin_width
+    _, wx, wy, vertical, escaped = _traverse_rays(grid, x0 + size / 2, y0 + size / 2, headings)
+    free, x0, y0, headings = free[~escaped], x0[~escaped], y0[~escaped], headings[~escaped]
+    wx, wy, vertical = wx[~escaped], wy[~escaped], vertical[~escaped]
+
+    # Bin edges are widened, so that rounding of the heading doesn't matter
+    a0, a1 = b[free] * bin_width - 1e-9, (b[free] + 1) * bin_width + 1e-9
+    cos0, sin0, cos1, sin1 = np.cos(a0), np.sin(a0), np.cos(a1), np.sin(a1)
+
+    step_x, step_y = np.sign(np.cos(headings)), np.sign(np.sin(headings))
+    face_x, face_y = np.where(step_x > 0, wx, wx + 1), np.where(step_y > 0, wy, wy + 1)
+    stable_x = vertical & _stable_faces(walls, x0, y0, size, face_x, step_x, cos0, sin0, cos1, sin1)
+    stable_y = ~vertical & _stable_faces(walls.T, y0, x0, size, face_y, step_y, sin0, cos0, sin1, cos1)
+
+    faces[free[stable_x]] = face_x[stable_x]
+    faces[free[stable_y]] = -1 - face_y[stable_y]
+    return faces
+
+def build_sonar_table(grid, bins=SONAR_TABLE_BINS, subdivision=SONAR_TABLE_SUBDIVISION,
+                      chunk_size=SONAR_TABLE_CHUNK_SIZE):
+    """
+    Precomputes for every part of the cell (cell is divided into
+    subdivision x subdivision squares) and every heading bin the wall face hit
+    by all sonar rays starting in this square with heading in this bin (if
+    there is a single such face). Entries are computed for whole rows of
+    squares, about chunk_size at a time, so that temporary arrays don't grow
+    with the board.
+
+    :param subdivision: power of 2, so that scaling of coordinates is exact
+    :returns dict with bins, bin_width, subdivision, M and faces (flat array,
+        vertical face x = f is stored as f, horizontal face y = f as -1 - f
+        and nan means that distance has to be computed by casting a ray)
+    """
+    grid = np.asarray(grid)
+    n, m = grid.shape
+    bin_width = 2 * pi / bins
+    walls = np.zeros((n + 1, m + 1), dtype=int)
+    walls[1:, 1:] = (grid == MAP_WALL).cumsum(axis=0).cumsum(axis=1)
+
+    row_size = m * subdivision * bins
+    rows = max(1, chunk_size // row_size)
+    faces = array.array("d")
+    for first in xrange(0, n * subdivision, rows):
+        sx, sy, b = [a.ravel() for a in np.meshgrid(np.arange(first, min(first + rows, n * subdivision)),
+                                                    np.arange(m * subdivision), np.arange(bins), indexing="ij")]
+        faces.fromstring(_sonar_table_faces(grid, walls, sx, sy, b, subdivision, bin_width).tostring())
+
+    return {"bins": bins, "bin_width": bin_width, "subdivision": subdivision, "M": m, "faces": faces}
+
+_sonar_tables = {}
+
+def get_sonar_table(map_):
+    """
+    :returns sonar table of the map, built on first use. Tables are cached
+        alongside the map and by board content (so that the same map loaded
+        again doesn't need rebuilding)
+    """
+    if "sonar_table" not in map_:
+        board = np.asarray(map_["board"])
+        key = (board.shape, board.tostring())
+        if key not in _sonar_tables:
+            if len(_sonar_tables) >= SONAR_TABLE_CACHE_SIZE:
+                _sonar_tables.clear()
+            _sonar_tables[key] = build_sonar_table(board)
+        map_["sonar_table"] = _sonar_tables[key]
+    return map_["sonar_table"]
+
+def sonar_distance(table, grid, x, y, orientation):
+    """
+    Same as cast_ray, but uses precomputed sonar table (see build_sonar_table)
+    and casts a ray only when the face is not known for the square and heading
+    """
+    subdivision, bins = table["subdivision"], table["bins"]
+    square = int(floor(x * subdivision)) * table["M"] * subdivision + int(floor(y * subdivision))
+    face = table["faces"][square * bins + int(floor(orientation / table["bin_width"])) % bins]
+    if face >= 0:
+        return (face - x) / cos(orientation)
+    elif face < 0:
+        return (-1 - face - y) / sin(orientation)
+    return cast_ray(grid, x, y, orientation)
 
 def load_map(file_name, load_graphics=True):
     """
@@ -87,3 +341,36 @@ def load_map(file_name, load_graphics=True):
         raise RuntimeError("Not supported custom board parsing")
 
     return map_
+
+_maps = OrderedDict()
+
+def get_map(file_name, load_graphics=True):
+    """
+    Loads map (see load_map) or returns the cached one. Maps are cached by
+    resolved path and modification time of the map file (and of its color
+    bitmap), least recently used maps are evicted.
+
+    :returns map, shared by all the callers so it must not be modified (color
+        bitmap is read-only)
+    """
+    path = os.path.realpath(file_name)
+    key = (path, os.path.getmtime(path), load_graphics)
+    if key in _maps:
+        map_, bitmap_mtime = _maps.pop(key)
+        if _mtime(map_['color_bitmap_file']) == bitmap_mtime:
+            _maps[key] = map_, bitmap_mtime
+            return map_
+
+    map_ = load_map(file_name, load_graphics)
+    if 'color_bitmap' in map_:
+        map_['color_bitmap'].setflags(write=False)
+    if len(_maps) >= MAP_CACHE_SIZE:
+        _maps.popitem(last=False)
+    _maps[key] = map_, _mtime(map_['color_bitmap_file'])
+    return map_
+
+def _mtime(file_name):
+    try:
+        return os.path.getmtime(file_name)
+    except OSError:
+        return None
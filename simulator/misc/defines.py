@@ -31,6 +31,68 @@ FINISH = "FINISH"
 SENSE_COLOR = "SENSE_COLOR"
 WRITE_CONSOLE = "WRITE_CONSOLE"
 
+### Protocol constants ###
+# Bot can answer first "act" request with "PROTOCOL FRAMED" to switch to
+# framed protocol: every request is then sent as a single message
+# (4 byte big endian payload length followed by records: 1 byte tag and
+# big endian fields, see PROTOCOL_RECORDS). Requests end with act record.
+# Replies are still sent as text lines.
+# Protocol can be followed by flags, EXPLICIT_COLOR means that the bot gets
+# color only after SENSE_COLOR command (and not before every act).
+# RESET flag means that the bot process can be reused for the next run: after
+# the run it gets "reset" line (or message with just reset record in framed
+# protocol), answers with "RESET" line and then reads parameters of the next
+# run (and chooses protocol again). Such bot should keep reading after FINISH
+# until reset or end of input.
+PROTOCOL = "PROTOCOL"
+PROTOCOL_TEXT = "TEXT"
+PROTOCOL_FRAMED = "FRAMED"
+PROTOCOL_EXPLICIT_COLOR = "EXPLICIT_COLOR"
+PROTOCOL_RESET = "RESET"
+PROTOCOL_RESET_REQUEST = "reset"
+PROTOCOL_RECORD_COLOR = "c"
+PROTOCOL_RECORD_TIME = "t"
+PROTOCOL_RECORD_SONAR = "s"
+PROTOCOL_RECORD_GPS = "g"
+PROTOCOL_RECORD_ACT = "a"
+PROTOCOL_RECORD_RESET = "r"
+PROTOCOL_RECORDS = {PROTOCOL_RECORD_COLOR: ">BBB",
+                    PROTOCOL_RECORD_TIME: ">d",
+                    PROTOCOL_RECORD_SONAR: ">d",
+                    PROTOCOL_RECORD_GPS: ">dd",
+                    PROTOCOL_RECORD_ACT: "",
+                    PROTOCOL_RECORD_RESET: ""}
+# Number of warm bot processes kept by ControllerPool
+CONTROLLER_POOL_SIZE = 2
+# Time (in seconds of wall time) the bot has to acknowledge reset, otherwise it is killed
+RESET_TIMEOUT = 1.0
+# Maximum number of bytes of the bot output read at once
+PIPE_READ_SIZE = 65536
+
+### Build constants ###
+# Submissions are built into BUILD_CACHE_DIR/<sha1 of the sources>: C++ (and
+# other) bots by "make BUILD_MAKE_TARGET" (producing BUILD_BINARY), Java bots
+# by javac. Build outputs are not hashed
+BUILD_CACHE_DIR = "~/.cache/krakrobot/builds"
+BUILD_MAKE_TARGET = "robot"
+BUILD_BINARY = "robot.bin"
+BUILD_LOG = "build.log"
+BUILD_IGNORED_FILES = [BUILD_BINARY, BUILD_LOG, "out.log"]
+BUILD_IGNORED_EXTENSIONS = [".class", ".o", ".pyc"]
+
+### Replay constants ###
+# Replay file: magic, version (>I), header (>I length + json with map
+# (with board SVG embedded as board_svg), parameters and results), chunks (tag, >I record count, >I payload length,
+# payload), index (>I length + json list of chunks) and footer (>Q index
+# offset + magic). Pose records are little endian, see replay.POSE_DTYPE.
+REPLAY_MAGIC = "KRAKREPLAY"
+REPLAY_VERSION = 1
+REPLAY_CHUNK_SIZE = 4096
+REPLAY_CHUNK_POSES = "p"
+REPLAY_CHUNK_BEEPS = "b"
+REPLAY_CHUNK_COLLISIONS = "x"
+REPLAY_CHUNK_CONSOLE = "l"
+
 ### Contest constants ###
 TICK_MOVE = 0.01
 TICK_ROTATE = 0.002
@@ -40,6 +102,24 @@ LIGHT_SENSOR_TIME = 0.0
 
 COLLISION_THRESHOLD = 50
 
+# Resolution of precomputed sonar table (number of heading bins and number of
+# parts every cell side is divided into) and how many tables (for distinct
+# boards) are kept in memory
+SONAR_TABLE_BINS = 360
+SONAR_TABLE_SUBDIVISION = 2
+SONAR_TABLE_CACHE_SIZE = 16
+# Number of entries of the sonar table computed at once (see build_sonar_table)
+SONAR_TABLE_CHUNK_SIZE = 1 << 16
+
+# How many loaded maps (for distinct map files) are kept in memory
+MAP_CACHE_SIZE = 16
+
+# Number of noise samples drawn at once for every noise channel (see noise.py)
+NOISE_BLOCK_SIZE = 4096
+
+# How often (in seconds of wall time) CPU time of the bot process is sampled
+CPU_TIME_SAMPLE_INTERVAL = 0.05
+
 DEFAULT_ANIMATION_RATE = 100
 
 DIRECTION_E = 2
@@ -7,6 +7,8 @@ from math import (
     pi
 )
 
+import numpy as np
+
 from misc.defines import *
 from vegesvgplot import (
     # Shape constants
@@ -22,13 +24,16 @@ from vegesvgplot import (
     ShapeFromVertices, TransformedShape, PiecewiseArc,
 
     # Output formatting functions
-    HTMLEscaped, ProgressColourStr,
+    HTMLEscaped, ProgressColourStr, MaxDP, AttrMarkup,
 
     # SVG functions
     SVGStart, SVGEnd, SVGPath, SVGText,
     SVGGroup, SVGGroupEnd, SVGGrid
 )
 
+# Board group transform of the frame template (board units to viewBox units)
+BOARD_TRANSFORM = (1.5, 0, 0, 1.5, 5.5, 1.5)
+
 def fill_visualisation_descriptor(Data):
     Map = Data['Map']
     Data['Title'] = 'KrakRobot 2016 Qualifications'
@@ -112,8 +117,126 @@ def PrepareFrame(frame_template, animated_part):
     return frame_template.format(*animated_part)
 
 
-def RenderAnimatedPart(Data):
-    """ Renders list of strings that will be injected to frame """
+def _simplified_indices(points, tolerance):
+    """ Douglas-Peucker simplification, returns indices of kept points """
+    if len(points) < 3 or tolerance <= 0:
+        return range(len(points))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        direction = points[last] - points[first]
+        inner = points[first + 1:last] - points[first]
+        # Distance to the segment (not to the line through its endpoints, so
+        # that moves back along the segment are kept)
+        length_squared = direction.dot(direction)
+        if length_squared == 0:
+            offsets = inner
+        else:
+            projections = np.clip(inner.dot(direction) / length_squared, 0.0, 1.0)
+            offsets = inner - projections[:, np.newaxis] * direction
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            farthest += first + 1
+            keep[farthest] = True
+            ranges += [(first, farthest), (farthest, last)]
+    return np.flatnonzero(keep).tolist()
+
+
+def simplify_path(vertices, tolerance):
+    """
+    Simplifies polyline (Douglas-Peucker), no vertex is farther than
+    tolerance from the simplified path
+    """
+    indices = _simplified_indices(np.asarray(vertices, dtype=np.float64).reshape(-1, 2), tolerance)
+    return [vertices[i] for i in indices]
+
+
+class IncrementalPath(object):
+    """
+    Polyline of the growing path (e.g. ActualPath of consecutive frames).
+    Vertices added since the last update are appended to the cached ones (and
+    to the cached path data, see render), everything is rebuilt only if the
+    path got shorter (e.g. animation went back).
+
+    With tolerance > 0 the path is simplified for display (Douglas-Peucker),
+    only the tail since the last committed vertex is simplified again on
+    every update (the tail is committed after tail_size vertices anyway)
+    """
+
+    def __init__(self, tolerance=0.0, tail_size=1000):
+        self.tolerance = tolerance
+        self.tail_size = tail_size
+        self.reset()
+
+    def reset(self):
+        # Indices of the displayed vertices, first committed of them are final
+        self.indices = []
+        self.committed = 0
+        self.count = 0
+        self.segments = []
+
+    def update(self, vertices, length=None):
+        """
+        :param length: number of vertices of the path (default len(vertices))
+        :returns index (in self.indices) of the first displayed vertex that
+            has changed since the last update
+        """
+        length = len(vertices) if length is None else length
+        if length < self.count:
+            self.reset()
+        if length == self.count:
+            return len(self.indices)
+
+        if self.tolerance <= 0:
+            first = len(self.indices)
+            self.indices.extend(xrange(self.count, length))
+            self.committed = len(self.indices)
+        else:
+            # Last committed vertex is the first one of the tail
+            start = self.indices[self.committed - 1] if self.committed else 0
+            points = np.asarray(vertices[start:length], dtype=np.float64).reshape(-1, 2)
+            tail = [start + i for i in _simplified_indices(points, self.tolerance)]
+            if self.committed:
+                tail = tail[1:]
+            first = self.committed
+            while (first < len(self.indices) and first - self.committed < len(tail)
+                   and self.indices[first] == tail[first - self.committed]):
+                first += 1
+            self.indices[self.committed:] = tail
+            # Segments of the simplified tail are final, except the last one
+            if len(tail) > 1:
+                self.committed = len(self.indices) - 1
+            if length - start > self.tail_size:
+                self.committed = len(self.indices)
+
+        self.count = length
+        del self.segments[first:]
+        return first
+
+    def vertices(self, vertices, start=0):
+        """ :returns displayed vertices (from start) of the given path """
+        return [vertices[i] for i in self.indices[start:]]
+
+    def render(self, IT, vertices, attributes=None):
+        """ Renders the path (as SVGPath does), path data is updated incrementally """
+        self.update(vertices)
+        for i in self.indices[len(self.segments):]:
+            self.segments.append(('L ' if self.segments else 'M ') +
+                                 MaxDP(vertices[i][0], 6) + ',' + MaxDP(vertices[i][1], 6))
+        return IT('<path' + AttrMarkup(attributes, True) + ' d="' + '  '.join(self.segments) + '"/>')
+
+
+def RenderAnimatedPart(Data, path_renderer=None):
+    """ Renders list of strings that will be injected to frame
+
+    path_renderer (IncrementalPath) should be passed when consecutive frames
+    are rendered, so that only new vertices of the path are rendered
+    """
 
     # -----------------------------------------------------------------------------
 
@@ -150,10 +273,14 @@ def RenderAnimatedPart(Data):
     ActualPath = Field('ActualPath', None)
     if ActualPath is not None:
         path += IT('<!-- Actual path -->')
-        path += SVGPath(IT,
-                        ShapeFromVertices(ActualPath, 1),
-                        {'stroke': '#40f', 'stroke-width': '0.02'}
-                        )
+        if path_renderer is not None:
+            path += path_renderer.render(IT, ActualPath,
+                                         {'stroke': '#40f', 'stroke-width': '0.02'})
+        else:
+            path += SVGPath(IT,
+                            ShapeFromVertices(ActualPath, 1),
+                            {'stroke': '#40f', 'stroke-width': '0.02'}
+                            )
 
 
     # ??
@@ -194,6 +321,19 @@ def RenderAnimatedPart(Data):
     return [robot_sprite, path, sparks]
 
 
+def BoardSVG(Map):
+    '''Return SVG of the board of the map: the one embedded in the map
+    (board_svg, e.g. in replays) or the part of its vector_graphics_file
+    between "<!-- Board -->" comments.'''
+
+    if 'board_svg' in Map:
+        return Map['board_svg']
+    board_data = open(Map['vector_graphics_file']).read().splitlines()
+    board_data = board_data[board_data.index("<!-- Board -->")+1:]
+    board_data = board_data[0:board_data.index("<!-- Board -->")]
+    return "\n".join(board_data)
+
+
 def RenderFrameTemplate(Data, draw_dynamic_elements=True):
     '''Return Data rendered to an SVG file in a string.
 
@@ -279,15 +419,11 @@ def RenderFrameTemplate(Data, draw_dynamic_elements=True):
     # Substitute for the group created by SVGGrid that is now deleted
 
     Result += SVGGroup(IT, {'stroke': 'black', 'stroke-width':'butt',
-        'transform': 'matrix(1.5, 0, 0, 1.5, 5.5, 1.5)', 'fill': 'none'})
+        'transform': 'matrix(%g, %g, %g, %g, %g, %g)' % BOARD_TRANSFORM, 'fill': 'none'})
 
     Result += IT('<!-- Background -->')
 
-    # Extract part of SVG with board
-    board_data = open(Data['Map']['vector_graphics_file']).read().splitlines()
-    board_data = board_data[board_data.index("<!-- Board -->")+1:]
-    board_data = board_data[0:board_data.index("<!-- Board -->")]
-    Result += IT("\n".join(board_data))
+    Result += IT(BoardSVG(Data['Map']))
 
     # Iniial position
     StartPos = Field('StartPos', None)
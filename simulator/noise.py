@@ -0,0 +1,69 @@
+""" Noise of robot movement and sensors """
+
+import numpy as np
+
+from misc.defines import *
+
+# Every channel has its own random stream (seeded with seed and index of the
+# channel), so noise of a channel doesn't depend on how others are used.
+# New channels should be appended, so that the existing streams are kept.
+NOISE_CHANNELS = ("distance", "steering", "color", "sonar", "gps")
+
+
+class NoiseProvider(object):
+    """
+    Serves gaussian noise for the channels from blocks of samples drawn in
+    advance (NOISE_BLOCK_SIZE at a time). Samples are served in the order
+    they were drawn, so the noise doesn't depend on the block size or on
+    whether it is requested one by one or in arrays
+    """
+
+    def __init__(self, seed, block_size=NOISE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._rngs = dict((channel, np.random.RandomState([seed, i]))
+                          for i, channel in enumerate(NOISE_CHANNELS))
+        # Current block of every channel (as array and list) and position in it
+        self._blocks = dict((channel, (np.empty(0), [])) for channel in NOISE_CHANNELS)
+        self._positions = dict((channel, 0) for channel in NOISE_CHANNELS)
+
+    def _refill(self, channel):
+        block = self._rngs[channel].standard_normal(self.block_size)
+        self._blocks[channel] = (block, block.tolist())
+        self._positions[channel] = 0
+
+    def standard_normal(self, channel, size=None):
+        """
+        :returns next sample (float) of the channel, or array of next size samples
+        """
+        position = self._positions[channel]
+        if size is None:
+            if position == self.block_size or not self._blocks[channel][1]:
+                self._refill(channel)
+                position = 0
+            self._positions[channel] = position + 1
+            return self._blocks[channel][1][position]
+
+        parts = []
+        while size > 0:
+            block = self._blocks[channel][0]
+            if position == len(block):
+                self._refill(channel)
+                position = 0
+                block = self._blocks[channel][0]
+            taken = min(size, len(block) - position)
+            parts.append(block[position:position + taken])
+            position += taken
+            size -= taken
+        self._positions[channel] = position
+        return np.concatenate([np.empty(0)] + parts)
+
+    def normal(self, channel, loc, scale):
+        """
+        :returns loc + scale * (next sample of the channel), loc can be an
+            array (then a sample is used for each element)
+        """
+        if scale < 0:
+            raise ValueError("scale < 0")
+        if isinstance(loc, np.ndarray):
+            return loc + scale * self.standard_normal(channel, loc.size)
+        return loc + scale * self.standard_normal(channel)
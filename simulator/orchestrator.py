@@ -0,0 +1,50 @@
+""" Running many simulations in one thread, interleaved while their bots think """
+
+import select
+import traceback
+
+
+def run_interleaved(simulators, max_running=None):
+    """
+    Runs simulations (KrakrobotSimulator objects) in the calling thread, at
+    most max_running (default: all) at a time. Simulation waiting for a reply
+    of its bot is suspended (see KrakrobotSimulator.run_iter) and the others
+    are run until some of the bots replies (select() on their pipes) or
+    poll_timeout() of its controller passes, so the process is busy as long
+    as any simulation can make progress.
+
+    :returns generator of (index of the simulator, result of its run) pairs
+        in order of completion. Exception raised by a simulation (e.g. when
+        its bot can't be started) is returned as its result (as error)
+    """
+    max_running = max_running or len(simulators)
+    pending = list(enumerate(simulators))[::-1]
+    ready = []  # (index, steps) of simulations that can be run at once
+    waiting = {}  # file descriptor -> (index, steps, controller) of simulations waiting for their bots
+
+    while pending or ready or waiting:
+        while pending and len(ready) + len(waiting) < max_running:
+            index, simulator = pending.pop()
+            ready.append((index, simulator.run_iter()))
+
+        if not ready:
+            timeouts = [controller.poll_timeout() for _, _, controller in waiting.itervalues()]
+            timeouts = [timeout for timeout in timeouts if timeout is not None]
+            readable = set(select.select(list(waiting), [], [], min(timeouts) if timeouts else None)[0])
+            for fd in list(waiting):
+                if fd in readable or waiting[fd][2].poll_timeout() == 0:
+                    ready.append(waiting.pop(fd)[:2])
+
+        running, ready = ready, []
+        for index, steps in running:
+            try:
+                controller = next(steps, None)
+            except Exception, e:
+                yield index, {"error": str(e), "error_traceback": traceback.format_exc()}
+                continue
+            if controller is None:
+                yield index, simulators[index].returned_results
+            elif controller.fileno() is None:
+                ready.append((index, steps))
+            else:
+                waiting[controller.fileno()] = (index, steps, controller)
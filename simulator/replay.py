@@ -0,0 +1,255 @@
+""" Replay files: recorded runs that can be watched without running the robot again """
+
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from misc.defines import *
+
+POSE_DTYPE = np.dtype([("time_elapsed", "<f8"), ("x", "<f8"), ("y", "<f8"),
+                       ("orientation", "<f8"), ("command_id", "<i4")])
+
+_CHUNK_HEADER = ">cII"
+_FOOTER = ">Q"
+
+
+class ReplayWriter(object):
+    """ Writes replay file (see REPLAY_MAGIC in misc.defines for the layout) """
+
+    def __init__(self, file_name, header):
+        """
+        :param header: json serializable dict, should contain map, parameters
+            and results of the run
+        """
+        self.file = open(file_name, "wb")
+        self.index = []
+        header = json.dumps(header)
+        self.file.write(REPLAY_MAGIC + struct.pack(">I", REPLAY_VERSION))
+        self.file.write(struct.pack(">I", len(header)) + header)
+
+    def _write_chunk(self, tag, count, payload, **info):
+        self.file.write(struct.pack(_CHUNK_HEADER, tag, count, len(payload)))
+        info.update({"tag": tag, "offset": self.file.tell(), "count": count})
+        self.index.append(info)
+        self.file.write(payload)
+
+    def write_poses(self, tag, recorder):
+        """ Writes poses recorded by TrajectoryRecorder in chunks of REPLAY_CHUNK_SIZE """
+        columns = dict((name, recorder.column(name)) for name in POSE_DTYPE.names)
+        for start in xrange(0, len(recorder), REPLAY_CHUNK_SIZE):
+            records = np.empty(min(REPLAY_CHUNK_SIZE, len(recorder) - start), dtype=POSE_DTYPE)
+            for name, values in columns.iteritems():
+                records[name] = values[start:start + len(records)]
+            self._write_chunk(tag, len(records), records.tostring(), first=start,
+                              start_time=float(records["time_elapsed"][0]),
+                              end_time=float(records["time_elapsed"][-1]))
+
+    def write_console(self, lines):
+        """ Writes console lines given as (time, text) pairs """
+        for start in xrange(0, len(lines), REPLAY_CHUNK_SIZE):
+            chunk = lines[start:start + REPLAY_CHUNK_SIZE]
+            payload = []
+            for time, text in chunk:
+                if isinstance(text, str):
+                    # Lines written by the bot are bytes, not necessarily UTF-8
+                    text = text.decode("utf-8", "replace")
+                text = unicode(text).encode("utf-8")
+                payload.append(struct.pack(">dI", time, len(text)) + text)
+            self._write_chunk(REPLAY_CHUNK_CONSOLE, len(chunk), "".join(payload),
+                              start_time=chunk[0][0], end_time=chunk[-1][0])
+
+    def close(self):
+        index_offset = self.file.tell()
+        index = json.dumps(self.index)
+        self.file.write(struct.pack(">I", len(index)) + index)
+        self.file.write(struct.pack(_FOOTER, index_offset) + REPLAY_MAGIC)
+        self.file.close()
+
+
+class ReplayReader(object):
+    """
+    Reads replay file. File is memory-mapped: only the header and the index
+    are parsed on opening and chunks of records are numpy views of the mapped
+    file (so they are paged in only when needed and never copied)
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+        magic, version = self._read(len(REPLAY_MAGIC)), self._unpack(">I")[0]
+        if magic != REPLAY_MAGIC:
+            raise KrakrobotException("Not a replay file: " + file_name)
+        if version != REPLAY_VERSION:
+            raise KrakrobotException("Unsupported replay file version " + str(version))
+        self.header = json.loads(self._read(self._unpack(">I")[0]))
+
+        self.position = len(self.mmap) - struct.calcsize(_FOOTER) - len(REPLAY_MAGIC)
+        index_offset = self._unpack(_FOOTER)[0]
+        if self._read(len(REPLAY_MAGIC)) != REPLAY_MAGIC:
+            raise KrakrobotException("Replay file is truncated: " + file_name)
+        self.position = index_offset
+        self.index = json.loads(self._read(self._unpack(">I")[0]))
+
+        self._chunks = {}
+        for entry in self.index:
+            self._chunks.setdefault(entry["tag"], []).append(entry)
+        self._start_times = dict((tag, np.array([entry["start_time"] for entry in chunks]))
+                                 for tag, chunks in self._chunks.iteritems())
+
+    def _read(self, size):
+        self.position += size
+        return self.mmap[self.position - size:self.position]
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self._read(struct.calcsize(fmt)))
+
+    def _records(self, entry):
+        return np.frombuffer(self.mmap, POSE_DTYPE, entry["count"], entry["offset"])
+
+    def close(self):
+        self.mmap.close()
+
+    def count(self, tag=REPLAY_CHUNK_POSES):
+        return sum(entry["count"] for entry in self._chunks.get(tag, []))
+
+    def records(self, tag=REPLAY_CHUNK_POSES, start_time=float("-inf"), end_time=float("inf")):
+        """
+        :returns array of POSE_DTYPE records with start_time <= time_elapsed <= end_time
+            (a view if they are all in a single chunk)
+        """
+        records = [self._records(entry) for entry in self._chunks.get(tag, [])
+                   if entry["end_time"] >= start_time and entry["start_time"] <= end_time]
+        if not records:
+            return np.empty(0, dtype=POSE_DTYPE)
+        records = records[0] if len(records) == 1 else np.concatenate(records)
+        times = records["time_elapsed"]
+        return records[np.searchsorted(times, start_time, side="left"):np.searchsorted(times, end_time, side="right")]
+
+    def sample(self, times, tag=REPLAY_CHUNK_POSES):
+        """
+        :param times: sorted array of times
+        :returns array of records, for every time the last one with
+            time_elapsed <= time (or the first record)
+        """
+        times = np.asarray(times, dtype=np.float64)
+        chunks = self._chunks[tag]
+        chunk_ids = (np.searchsorted(self._start_times[tag], times, side="right") - 1).clip(0)
+        samples = np.empty(len(times), dtype=POSE_DTYPE)
+        for chunk_id in np.unique(chunk_ids):
+            selected = chunk_ids == chunk_id
+            records = self._records(chunks[chunk_id])
+            samples[selected] = records[(np.searchsorted(records["time_elapsed"], times[selected],
+                                                         side="right") - 1).clip(0)]
+        return samples
+
+    def pose_at(self, time, tag=REPLAY_CHUNK_POSES):
+        """
+        :returns last record with time_elapsed <= time (or the first record)
+        """
+        return self.sample([time], tag)[0]
+
+    def console_lines(self):
+        """
+        :returns list of (time, text) pairs
+        """
+        lines = []
+        for entry in self._chunks.get(REPLAY_CHUNK_CONSOLE, []):
+            self.position = entry["offset"]
+            for _ in xrange(entry["count"]):
+                time, length = self._unpack(">dI")
+                lines.append((time, self._read(length).decode("utf-8")))
+        return lines
+
+
+def write_replay(file_name, header, trajectory, beeps, collisions, console_lines):
+    """ Writes whole replay file """
+    writer = ReplayWriter(file_name, header)
+    try:
+        writer.write_poses(REPLAY_CHUNK_POSES, trajectory)
+        writer.write_poses(REPLAY_CHUNK_BEEPS, beeps)
+        writer.write_poses(REPLAY_CHUNK_COLLISIONS, collisions)
+        writer.write_console(console_lines)
+    finally:
+        writer.close()
+
+
+class ReplayPlayer(object):
+    """
+    Plays replay file. Trajectory is resampled at frame_dt once on opening
+    and only compact state of every frame is kept (pose and lengths of path
+    and sparks), so any frame can be shown at once. Exposes the same
+    interface for results and logs as KrakrobotSimulator, so it can be shown
+    in the GUI
+    """
+
+    def __init__(self, file_name, frame_dt=None):
+        self.reader = ReplayReader(file_name)
+        parameters = self.reader.header["parameters"]
+        self.map = self.reader.header["map"]
+        self.init_position = tuple(parameters["init_position"])
+        self.frame_dt = frame_dt or parameters["frame_dt"]
+        self.results = self.reader.header["results"]
+        self.end_time = self.reader.pose_at(float("inf"))["time_elapsed"]
+        self.logs = ["{'frame': " + str(int(time / self.frame_dt)) + ", 'time': " + str(time) + '}:\n' + text
+                     for time, text in self.reader.console_lines()]
+        self.finished = True
+
+        times = self.frame_time(np.arange(self.frame_count()))
+        poses = self.reader.sample(times)
+        xs, ys = poses["x"], poses["y"]
+        # Path points are added only when the robot has moved
+        moved = np.ones(len(poses), dtype=bool)
+        moved[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+        beeps = self.reader.records(REPLAY_CHUNK_BEEPS)
+
+        self.path = np.column_stack((xs[moved], ys[moved]))
+        self.sparks = zip(beeps["x"].tolist(), beeps["y"].tolist(), beeps["time_elapsed"].tolist())
+        self.positions = np.column_stack((xs, ys))
+        self.orientations = poses["orientation"].copy()
+        self.path_lengths = np.cumsum(moved)
+        self.sparks_counts = np.searchsorted(beeps["time_elapsed"], times, side="right")
+
+    def frame_count(self):
+        return int(self.end_time / self.frame_dt) + 2
+
+    def frame_time(self, frame):
+        return np.minimum(frame * self.frame_dt, self.end_time)
+
+    def run(self):
+        """ Nothing is simulated, frames are read from the replay """
+        return self.results
+
+    def terminate(self):
+        pass
+
+    def get_results(self):
+        return self.results
+
+    def get_logs(self):
+        return self.logs
+
+    def frame_state(self, frame):
+        """
+            @returns (position, orientation, path length, sparks count) of the frame
+        """
+        return (self.positions[frame].tolist(), float(self.orientations[frame]),
+                int(self.path_lengths[frame]), int(self.sparks_counts[frame]))
+
+    def frame(self, frame):
+        """
+            @returns descriptor of the frame, with path sampled at the frame
+            times and beeps up to the frame (as expected by visualisation)
+        """
+        position, orientation, path_length, sparks_count = self.frame_state(frame)
+        data = {}
+        data['Sparks'] = self.sparks[:sparks_count]
+        data['ActualPath'] = map(tuple, self.path[:path_length].tolist())
+        data['ActualPosition'] = position
+        data['ActualOrientation'] = orientation
+        data['Map'] = self.map
+        data['StartPos'] = self.init_position
+        return data
@@ -1,12 +1,40 @@
 from math import (
     pi, sqrt, sin, cos
 )
-from copy import deepcopy
 
 import numpy as np
 
-from map import get_color
+from map import get_color, cast_ray, sonar_distance
 from misc.defines import *
+from noise import NoiseProvider
+
+
+def _accumulate_orientation(orientation, increments):
+    """
+    Vectorized equivalent of applying
+    orientation = (orientation + increment) % (2 * pi) for each increment.
+
+    Angles are summed with np.cumsum (which is evaluated sequentially) and
+    wrapped with the same float modulo as the per-tick code, only at ticks
+    where wrapping is actually needed, so the result is bit-identical.
+
+    :returns array of len(increments) + 1 orientations, starting with orientation
+    """
+    full_angle = 2 * pi
+    result = np.empty(len(increments) + 1)
+    result[0] = orientation
+    start = 0
+    while start < len(increments):
+        chunk = np.cumsum(np.concatenate(([result[start]], increments[start:])))
+        out_of_range = np.flatnonzero((chunk < 0.0) | (chunk >= full_angle))
+        if len(out_of_range) == 0:
+            result[start:] = chunk
+            break
+        wrap = out_of_range[0]
+        result[start:start + wrap] = chunk[:wrap]
+        result[start + wrap] = float(chunk[wrap]) % full_angle
+        start += wrap
+    return result
 
 
 class Robot:
@@ -18,7 +46,7 @@ class Robot:
         Initialize robot
         """
         self.speed = speed
-        self.rng = np.random.RandomState(seed)
+        self.noise = NoiseProvider(seed)
         self.tick_move = tick_move
         self.tick_rotate = tick_rotate
         self.color_sensor_displacement = color_sensor_displacement
@@ -57,59 +85,193 @@ class Robot:
         self.measurement_noise = float(new_m_noise)
         self.sonar_noise = float(new_sonar_noise)
 
-    def check_collision(self, grid):
+    def check_collision(self, grid, pose=None):
         """
         Checks for collisions by checking if color sensor is hitting wal
         (color sensor is located at the tip of the robot)
 
+        :param pose - (x, y, orientation, time_elapsed) tuple returned by
+            propose_move, if None current position of the robot is checked
         :note Cannot be called by contestant
         :returns True if no collisions
         """
+        if pose is None:
+            x, y = self.x, self.y
+        else:
+            x, y = pose[0], pose[1]
+
         # Collision is checked now against the center of the robot
         # dcx = self.color_sensor_displacement * cos(self.orientation)
         # dcy = self.color_sensor_displacement * sin(self.orientation)
         dcx, dcy = 0, 0
-        x_disc, y_disc = int(self.x + dcx), int(self.y + dcy)
+        x_disc, y_disc = int(x + dcx), int(y + dcy)
         if grid[x_disc][y_disc] == 1:
             return False
 
         return True
 
-    def move(self, x):
+    def pose(self):
+        """
+        :returns current pose as (x, y, orientation, time_elapsed) tuple
         """
-        Move the robot forward by x **Ticks**
+        return self.x, self.y, self.orientation, self.time_elapsed
+
+    def commit(self, pose):
         """
+        Apply pose proposed by propose_move or propose_turn
 
-        if (abs(x) > 1): raise ("Illegal move")
+        :note Cannot be called by contestant
+        """
+        self.x, self.y, self.orientation, self.time_elapsed = pose
 
+    def propose_move(self, x):
+        """
+        Compute pose after moving the robot forward by x **Ticks**. Noise is
+        drawn from the robot noise provider, but the robot itself is not modified.
 
-        distance = np.sign(x) * max(0.0, self.rng.normal(int(abs(x)) * self.tick_move, self.distance_noise))
-        res = deepcopy(self)
-        res.x += distance * cos(res.orientation)
-        res.y += distance * sin(res.orientation)
-        res.time_elapsed += abs(distance / self.speed)  # speed is 1.0/time_unit
+        :returns proposed pose as (x, y, orientation, time_elapsed) tuple
+        """
 
-        turn = self.forward_steering_drift
+        if abs(x) > 1:
+            raise RuntimeError("Illegal move")
 
-        res.orientation = (res.orientation + turn) % (2 * pi)
+        distance = np.sign(x) * max(0.0, self.noise.normal("distance", int(abs(x)) * self.tick_move, self.distance_noise))
 
-        return res
+        return (self.x + distance * cos(self.orientation),
+                self.y + distance * sin(self.orientation),
+                (self.orientation + self.forward_steering_drift) % (2 * pi),
+                self.time_elapsed + abs(distance / self.speed))  # speed is 1.0/time_unit
 
-    def turn(self, x):
+    def propose_turn(self, x):
         """
-        Turn robot by x **Ticks**
+        Compute pose after turning the robot by x **Ticks**. Noise is
+        drawn from the robot noise provider, but the robot itself is not modified.
+
+        :returns proposed pose as (x, y, orientation, time_elapsed) tuple
         """
 
         if abs(x) > 1:
             raise RuntimeError("Illegal turn")
 
+        turn = self.noise.normal("steering", int(x) * self.tick_rotate, self.steering_noise)
+
+        return (self.x,
+                self.y,
+                (self.orientation - turn) % (2 * pi),
+                self.time_elapsed + abs(turn / self.turning_speed))  # speed is pi/time_unit
+
+    def move(self, x):
+        """
+        Move the robot forward by x **Ticks** (in place)
+
+        :returns self
+        """
+        self.commit(self.propose_move(x))
+        return self
+
+    def turn(self, x):
+        """
+        Turn robot by x **Ticks** (in place)
+
+        :returns self
+        """
+        self.commit(self.propose_turn(x))
+        return self
+
+    def move_ticks(self, x, grid, time_limit=float("inf"), max_collisions=COLLISION_THRESHOLD,
+                   recorder=None, command_id=-1):
+        """
+        Execute whole MOVE x command (x ticks of move(sign(x)) followed by the
+        final move(0) tick) in one vectorized batch. Produces exactly the same
+        pose and collisions as calling propose_move/check_collision/commit tick
+        by tick.
+
+        Noise for all ticks is drawn at once, so if execution stops early
+        (time limit or max_collisions) more samples are drawn than the per-tick
+        loop would draw. The simulation ends in both cases anyway.
+
+        :param grid - board as 2D numpy array
+        :param time_limit - ticks are not started once time_elapsed >= time_limit
+        :param max_collisions - stop after this many rejected ticks
+        :param recorder - TrajectoryRecorder receiving poses of accepted ticks
+            (tagged with command_id)
+        :returns list of rejected (colliding) poses
+        """
+        x = int(x)
+        signs = np.empty(abs(x) + 1)
+        signs[:-1] = np.sign(x)
+        signs[-1] = 0.0
+        distances = signs * np.maximum(0.0, self.noise.normal("distance", np.abs(signs) * self.tick_move, self.distance_noise))
+
+        collisions = []
+        tick = 0
+        while tick < len(distances):
+            if self.time_elapsed >= time_limit:
+                break
+
+            d = distances[tick:]
+            orientations = _accumulate_orientation(self.orientation,
+                                                   np.repeat(self.forward_steering_drift, len(d)))
+            xs = np.cumsum(np.concatenate(([self.x], d * np.cos(orientations[:-1]))))
+            ys = np.cumsum(np.concatenate(([self.y], d * np.sin(orientations[:-1]))))
+            times = np.cumsum(np.concatenate(([self.time_elapsed], np.abs(d / self.speed))))
+
+            # Ticks are started only while time is below the limit
+            allowed = int(np.searchsorted(times, time_limit, side="left"))
+            allowed = min(allowed, len(d))
+
+            # First tick whose proposed pose needs a closer look (wall or outside of the board)
+            ix, iy = xs[1:allowed + 1].astype(int), ys[1:allowed + 1].astype(int)
+            suspicious = (ix < 0) | (ix >= grid.shape[0]) | (iy < 0) | (iy >= grid.shape[1])
+            suspicious[~suspicious] = grid[ix[~suspicious], iy[~suspicious]] == MAP_WALL
+            suspicious = np.flatnonzero(suspicious)
+            accepted = suspicious[0] if len(suspicious) else allowed
+
+            self.commit((xs[accepted], ys[accepted], orientations[accepted], times[accepted]))
+            if recorder is not None:
+                recorder.extend(xs[1:accepted + 1], ys[1:accepted + 1], orientations[1:accepted + 1],
+                                times[1:accepted + 1], command_id)
+            tick += accepted
+            if accepted == allowed:
+                break
+
+            # Process suspicious tick exactly as the per-tick code does
+            proposed_pose = (xs[accepted + 1], ys[accepted + 1], orientations[accepted + 1], times[accepted + 1])
+            if not self.check_collision(grid, proposed_pose):
+                collisions.append(proposed_pose)
+                if len(collisions) >= max_collisions:
+                    break
+            else:
+                self.commit(proposed_pose)
+                if recorder is not None:
+                    recorder.append(*(proposed_pose + (command_id,)))
+            tick += 1
+
+        return collisions
+
+    def turn_ticks(self, x, time_limit=float("inf"), recorder=None, command_id=-1):
+        """
+        Execute whole TURN x command (x ticks of turn(sign(x)) followed by the
+        final turn(0) tick) in one vectorized batch. Produces exactly the same
+        pose as calling turn tick by tick.
+
+        :param time_limit - ticks are not started once time_elapsed >= time_limit
+        :param recorder - TrajectoryRecorder receiving poses of the ticks
+            (tagged with command_id)
+        """
+        x = int(x)
+        signs = np.empty(abs(x) + 1)
+        signs[:-1] = np.sign(x)
+        signs[-1] = 0.0
+        turns = self.noise.normal("steering", signs * self.tick_rotate, self.steering_noise)
 
+        orientations = _accumulate_orientation(self.orientation, -turns)
+        times = np.cumsum(np.concatenate(([self.time_elapsed], np.abs(turns / self.turning_speed))))
 
-        turn = self.rng.normal(int(x) * self.tick_rotate, self.steering_noise)
-        res = deepcopy(self)
-        res.orientation = (res.orientation - turn) % (2 * pi)
-        res.time_elapsed += abs(turn / self.turning_speed)  # speed is pi/time_unit
-        return res
+        allowed = min(int(np.searchsorted(times, time_limit, side="left")), len(turns))
+        self.orientation, self.time_elapsed = orientations[allowed], times[allowed]
+        if recorder is not None:
+            recorder.extend(self.x, self.y, orientations[1:allowed + 1], times[1:allowed + 1], command_id)
 
     def sense_color(self, map):
         """
@@ -122,7 +284,7 @@ class Robot:
         raw_color = get_color(map, self.x + dcx,
                          self.y + dcy)
 
-        random_vector = self.rng.normal(0, 1.0, size=(3,))
+        random_vector = self.noise.standard_normal("color", 3)
         random_vector /= np.linalg.norm(random_vector)
         random_vector *= self.color_noise
 
@@ -132,86 +294,22 @@ class Robot:
     def sense_gps(self):
         """ Returns estimation for position (GPS signal) """
         self.time_elapsed += self.gps_time
-        ret = [self.rng.normal(self.x, self.measurement_noise),
-               self.rng.normal(self.y, self.measurement_noise)]
+        ret = [self.noise.normal("gps", self.x, self.measurement_noise),
+               self.noise.normal("gps", self.y, self.measurement_noise)]
         return ret
 
-    def sense_sonar(self, grid):
+    def sense_sonar(self, grid, sonar_table=None):
         """
-        Returns distance to wall using 128bit precision floats
+        Returns distance to wall (found by traversing grid cells along the ray
+        or looked up in sonar_table, see map.build_sonar_table)
         """
-        tolerance_a = np.float64(1e-13)
-        max_a = np.float64(1e10)
-        found = False
-
-        def is_hit(x, y):
-            tolerance_xy = np.float64(1e-4)  # will check nearby
-            exact_hit = grid[int(x)][int(y)] == 1
-            hit_right = int(x) < (len(grid) - 1) and grid[int(x) + 1][int(y)] == 1 and (x - int(x)) > (
-                SQUARE_SIDE - tolerance_xy)
-            hit_left = int(x) > 0 and grid[int(x) - 1][int(y)] == 1 and (x - int(x)) < tolerance_xy
-            hit_top = int(y) < (len(grid[0]) - 1) and grid[int(x)][int(y) + 1] == 1 and (y - int(y)) > (
-                SQUARE_SIDE - tolerance_xy)
-            hit_bottom = int(y) > 0 and grid[int(x)][int(y) - 1] == 1 and (y - int(y)) < tolerance_xy
-            return exact_hit or hit_right or hit_left or hit_top or hit_bottom
-
-        x_min_col, y_min_col = [np.float64(0), np.float64(0), np.float64(1e100)], [np.float64(0), np.float64(0),
-                                                                                   np.float64(1e100)]
-
-        x, y = np.float64(self.x + SQUARE_SIDE / 2.0), np.float64((self.y + SQUARE_SIDE / 2.0))
-        # logger.info(("robot:",x," ",y," ",self.orientation))
-        x_disc, y_disc = int(x), int(y)
-
-        orient_x = np.float64(np.cos(np.float64(self.orientation)))
-        orient_y = np.float64(np.sin(np.float64(self.orientation)))
-        a = np.float64(np.tan(np.float64(self.orientation)))
-        b = np.float64(y - a * x)
-
-        for i in xrange(0, len(grid)):
-
-            if a > max_a:
-                cross_x, cross_y = np.float64(x), np.float64(float(i) + 1e-10)
-            else:
-                cross_x, cross_y = np.float64(float(i) + 1e-10), np.float64(a * (float(i) + 1e-10) + b)
-
-            if cross_x < 0.0 or cross_x > len(grid) * SQUARE_SIDE or cross_y < 0.0 or cross_y > len(
-                    grid[0]) * SQUARE_SIDE:
-                continue
-
-            diff_x, diff_y = np.float64(cross_x - x), np.float64(cross_y - y)
-
-            if orient_x * diff_x + orient_y * diff_y > 0:
-                # logger.info((cross_x, cross_y))
-                if is_hit(cross_x, cross_y) and (diff_x ** 2 + diff_y ** 2) < x_min_col[2]:
-                    x_min_col = [cross_x, cross_y, (diff_x ** 2 + diff_y ** 2)]
-                    found = True
-
-        # Find collisions with y walls
-        for i in xrange(0, len(grid[0])):
-            # Check if line is almost parallel to the axis
-            if abs(a) > tolerance_a:
-
-                cross_x, cross_y = np.float64((float(i) + np.float64(1e-10) - b) / a), \
-                                   np.float64(float(i) + 1e-10)
-            else:
-                cross_x, cross_y = np.float64(float(i) + 1e-10), np.float64(y)
-
-            if cross_x < 0.0 or cross_x > len(grid) * SQUARE_SIDE or cross_y < 0.0 or cross_y > len(
-                    grid[0]) * SQUARE_SIDE:
-                continue
-
-            diff_x, diff_y = np.float64(cross_x - x), np.float64(cross_y - y)
-            if orient_x * diff_x + orient_y * diff_y > 0:
-                if is_hit(cross_x, cross_y) and (diff_x ** 2 + diff_y ** 2) < y_min_col[2]:
-                    y_min_col = [cross_x, cross_y, (diff_x ** 2 + diff_y ** 2)]
-                    found = True
-
-        if not found:
-            raise KrakrobotException(
-                "Something went wrong with sonar - not found wall! Note: boundary should be walled")
-
+        x, y = self.x + SQUARE_SIDE / 2.0, self.y + SQUARE_SIDE / 2.0
+        if sonar_table is not None:
+            distance = sonar_distance(sonar_table, grid, x, y, self.orientation)
+        else:
+            distance = cast_ray(grid, x, y, self.orientation)
         self.time_elapsed += self.sonar_time
-        return self.rng.normal(float(sqrt(min(x_min_col[2], y_min_col[2]))), self.sonar_noise)
+        return self.noise.normal("sonar", distance, self.sonar_noise)
 
     def __repr__(self):
         # return '[x=%.5f y=%.5f orient=%.5f]'  % (self.x, self.y, self.orientation)
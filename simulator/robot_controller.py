@@ -1,19 +1,64 @@
 from misc import *
+from misc.defines import *
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import fcntl
+import hashlib
+import os
+import pipes
+import re
+import select
+import shutil
 import subprocess
 import shlex
+import struct
+import sys
+import tempfile
+import time
 
 class RobotController(object):
     """ You have to implement this class """
+
+    # If True color is sensed and passed to act() before every decision,
+    # otherwise only on SENSE_COLOR command
+    implicit_color = True
+
     def init(starting_position, steering_noise, distance_noise, sonar_noise, forward_steering_drift,
                      measurement_noise, speed, turning_speed, gps_delay, execution_cpu_time_limit):
         """ @param starting_position - (x,y) tuple representing current_position """
         raise NotImplementedError()
 
-    def act(self):
-        """ Return next action """
+    def act(self, current_time, color=None):
+        """ Return next action
+
+        @param color - (r, g, b) color sensed before this decision or None
+        """
         raise NotImplementedError()
 
+    def send_act(self, current_time, color=None):
+        """ Requests next action, it is then returned by receive_act """
+        self._act_request = (current_time, color)
+
+    def receive_act(self):
+        """
+        @returns action requested by send_act, or None if the reply isn't
+        complete yet (it should be received again when fileno() is readable)
+        """
+        return self.act(*self._act_request) or []
+
+    def fileno(self):
+        """ @returns file descriptor readable when the reply of the bot can be received, or None """
+        return None
+
+    def poll_timeout(self):
+        """
+        @returns time (in seconds) after which the reply should be received
+        again even if fileno() isn't readable, or None if there is no limit
+        """
+        return None
+
     def on_sense_sonar(self, dist):
         """ React to sensory data """
         raise NotImplementedError()
@@ -26,85 +71,519 @@ class RobotController(object):
         """ React to sensory data """
         raise NotImplementedError()
 
+    def cpu_time(self, max_age=CPU_TIME_SAMPLE_INTERVAL):
+        """ @returns CPU time (in seconds) used by the bot so far or None if not measured """
+        return None
+
+    def send_release(self):
+        """ Called after the run, controller won't be used anymore once receive_release returns True """
+        pass
+
+    def receive_release(self):
+        """ @returns True if released, or None if waiting for the bot (like receive_act) """
+        return True
+
+    def release(self):
+        """ Releases the controller after the run, waiting for the bot """
+        self.send_release()
+        while self.receive_release() is None:
+            wait_for_controller(self)
+
     def terminate(self):
         pass
 
+def wait_for_controller(controller):
+    """ Blocks until the reply of the bot can be received by the controller (see fileno and poll_timeout) """
+    if controller.fileno() is not None:
+        select.select([controller.fileno()], [], [], controller.poll_timeout())
+
 class CmdLineRobotController(RobotController):
-    def __init__(self, cmd, init_kwargs=None):
+    """
+    Controller communicating with the bot process through stdin/stdout.
+
+    Text protocol is used by default. If the bot answers the first "act"
+    request with "PROTOCOL FRAMED" line, framed protocol is used from then
+    on: sensor readings are buffered and sent together with time and act
+    request as one message (see PROTOCOL_RECORDS in misc.defines). Bot can
+    also add EXPLICIT_COLOR flag to get color only on SENSE_COLOR.
+
+    In both protocols every request is written to the pipe at once. Output
+    of the bot is read without blocking and buffered until a whole line is
+    received.
+
+    If the bot adds RESET flag and pool is given, the bot process is reset
+    after the run and kept in the pool for the next runs of the same command
+    (CPU time of the run is then counted from init). Bot which doesn't
+    acknowledge reset within RESET_TIMEOUT is killed.
+    """
+    def __init__(self, cmd, init_kwargs=None, pool=None):
         self.cmd = cmd
         self.init_kwargs = init_kwargs
+        self.pool = pool
+        self.p = None
+        self.protocol = PROTOCOL_TEXT
+        self.implicit_color = True
+        self.reset_supported = False
+        self.pending_records = []
+        self._read_buffer = ""
+        self._reset_deadline = None
+        self._act_time = None
+        self._cpu_time = None
+        self._cpu_time_sampled_at = None
+        self._cpu_time_base = 0.0
 
     def clone(self):
-        return CmdLineRobotController(self.cmd, self.init_kwargs)
+        return CmdLineRobotController(self.cmd, self.init_kwargs, self.pool)
 
     def init(self, **kwargs):
-        self.p = subprocess.Popen(shlex.split(self.cmd), shell=False, stdout=subprocess.PIPE, \
-                                  stdin=subprocess.PIPE)
         assert len(kwargs) == 11, "Expected 11 parameters for constructor"
+        if self.pool is not None:
+            self.p = self.pool.acquire(self.cmd)
+        if self.p is not None:
+            self._cpu_time_base = process_tree_cpu_time(self.p.pid) or 0.0
+        else:
+            self.p = subprocess.Popen(shlex.split(self.cmd), shell=False, stdout=subprocess.PIPE, \
+                                      stdin=subprocess.PIPE)
+            fd = self.p.stdout.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
         for key, value in kwargs.iteritems():
             if not self.init_kwargs or key in self.init_kwargs:
                 self.p.stdin.write(key + ":" + str(value) + "\n")
 
-    def act(self, current_time):
-        self.p.stdin.write("time\n")
-        self.p.stdin.write(str(current_time) + "\n")
-        self.p.stdin.write("act\n")
-        return self.p.stdout.readline().split()
+    def act(self, current_time, color=None):
+        self.send_act(current_time, color)
+        response = self.receive_act()
+        while response is None:
+            wait_for_controller(self)
+            response = self.receive_act()
+        return response
+
+    def send_act(self, current_time, color=None):
+        self._act_time = current_time
+        if self.protocol == PROTOCOL_FRAMED:
+            if color is not None:
+                self._push_record(PROTOCOL_RECORD_COLOR, *color)
+            self._push_record(PROTOCOL_RECORD_TIME, current_time)
+            self._push_record(PROTOCOL_RECORD_ACT)
+            self._write_records()
+            return
+
+        request = "time\n" + str(current_time) + "\nact\n"
+        if color is not None:
+            request = "color\n" + " ".join(map(str, color)) + "\n" + request
+        self.p.stdin.write(request)
+
+    def receive_act(self):
+        line = self._read_line()
+        if line is None:
+            return None
+        response = line.split()
+        if self.protocol == PROTOCOL_TEXT and len(response) and response[0] == PROTOCOL:
+            # Bot has chosen protocol, act request is sent again (color has been already sent)
+            self._switch_protocol(response)
+            self.send_act(self._act_time)
+            return None
+        return response
+
+    def fileno(self):
+        return self.p.stdout.fileno()
+
+    def poll_timeout(self):
+        if self._reset_deadline is None:
+            return None
+        return max(0.0, self._reset_deadline - time.time())
+
+    def _read_line(self):
+        """ @returns next line of the bot output ("" at its end), or None if it isn't complete yet """
+        while "\n" not in self._read_buffer:
+            try:
+                data = os.read(self.p.stdout.fileno(), PIPE_READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return None
+                raise
+            if not data:
+                line, self._read_buffer = self._read_buffer, ""
+                return line
+            self._read_buffer += data
+        line, self._read_buffer = self._read_buffer.split("\n", 1)
+        return line + "\n"
 
     def on_sense_color(self, *args):
-        self.p.stdin.write("color\n")
-        self.p.stdin.write(" ".join(map(str, args)) + "\n")
+        self._send_sensor_reading("color", PROTOCOL_RECORD_COLOR, args)
 
     def on_sense_sonar(self, *args):
-        self.p.stdin.write("sonar\n")
-        self.p.stdin.write(" ".join(map(str, args)) + "\n")
+        self._send_sensor_reading("sonar", PROTOCOL_RECORD_SONAR, args)
 
     def on_sense_gps(self, *args):
-        self.p.stdin.write("gps\n")
-        self.p.stdin.write(" ".join(map(str, args)) + "\n")
+        self._send_sensor_reading("gps", PROTOCOL_RECORD_GPS, args)
+
+    def cpu_time(self, max_age=CPU_TIME_SAMPLE_INTERVAL):
+        """
+        @returns CPU time (in seconds) used by the bot process and its children,
+        sampled from /proc at most every max_age seconds, or None if not available
+        """
+        if self.p is None:
+            # Not started yet or released (then the last sample is kept)
+            return self._cpu_time
+        now = time.time()
+        if self._cpu_time_sampled_at is None or now - self._cpu_time_sampled_at >= max_age:
+            self._cpu_time_sampled_at = now
+            cpu_time = process_tree_cpu_time(self.p.pid)
+            # Keep last sample if process has been already reaped
+            if cpu_time is not None:
+                self._cpu_time = cpu_time - self._cpu_time_base
+        return self._cpu_time
+
+    def send_release(self):
+        """
+        Sends reset to the bot (if it supports RESET), its process is then
+        returned to the pool or killed by receive_release
+        """
+        if self.pool is None or self.p is None or not self.reset_supported:
+            return
+        self.cpu_time(max_age=0)
+        self._reset_deadline = time.time() + RESET_TIMEOUT
+        try:
+            if self.protocol == PROTOCOL_FRAMED:
+                self.pending_records = []
+                self._push_record(PROTOCOL_RECORD_RESET)
+                self._write_records()
+            else:
+                self.p.stdin.write(PROTOCOL_RESET_REQUEST + "\n")
+        except (IOError, OSError):
+            # Bot has already finished
+            self._reset_deadline = time.time()
+
+    def receive_release(self):
+        """
+        Returns the process to the pool if the bot has acknowledged reset,
+        kills it if it has answered something else or RESET_TIMEOUT has passed
+        """
+        if self._reset_deadline is None:
+            return True
+        try:
+            line = self._read_line()
+        except (IOError, OSError):
+            line = ""
+        if line is None and time.time() < self._reset_deadline:
+            return None
+        if line is not None and line.split() == [PROTOCOL_RESET]:
+            self.pool.release(self.cmd, self.p)
+        else:
+            self._kill()
+        self.p = None
+        self._reset_deadline = None
+        return True
+
+    def _kill(self):
+        """ Kills the bot process and waits for it """
+        try:
+            self.p.kill()
+        except OSError:
+            # Already finished
+            pass
+        for pipe in (self.p.stdin, self.p.stdout):
+            try:
+                pipe.close()
+            except IOError:
+                pass
+        self.p.wait()
 
     def terminate(self):
-        if hasattr(self, "p") and self.p:
+        if self.p:
             self.p.communicate()
 
+    def _switch_protocol(self, response):
+        if len(response) < 2 or response[1] not in [PROTOCOL_TEXT, PROTOCOL_FRAMED]:
+            raise KrakrobotException("Not supported protocol " + " ".join(response[1:]))
+        for flag in response[2:]:
+            if flag == PROTOCOL_EXPLICIT_COLOR:
+                self.implicit_color = False
+            elif flag == PROTOCOL_RESET:
+                self.reset_supported = True
+            else:
+                raise KrakrobotException("Not supported protocol flag " + flag)
+        self.protocol = response[1]
+
+    def _send_sensor_reading(self, name, tag, args):
+        if self.protocol == PROTOCOL_FRAMED:
+            self._push_record(tag, *args)
+        else:
+            self.p.stdin.write(name + "\n" + " ".join(map(str, args)) + "\n")
+
+    def _push_record(self, tag, *args):
+        self.pending_records.append(tag + struct.pack(PROTOCOL_RECORDS[tag], *args))
+
+    def _write_records(self):
+        payload = "".join(self.pending_records)
+        self.pending_records = []
+        self.p.stdin.write(struct.pack(">I", len(payload)) + payload)
+
+class PythonRobotController(RobotController):
+    """
+    Controller running bot class from a Python file (see compile_robot) in
+    the simulator process: sensor readings and act requests are plain method
+    calls. The file is loaded again by every run (in init), so module state
+    isn't shared between runs.
+
+    Bot is charged for CPU time of the simulator thread spent in its methods
+    (if thread CPU clock is available)
+    """
+    def __init__(self, file_name, init_kwargs=None):
+        self.file_name = file_name
+        self.init_kwargs = init_kwargs
+        self.module = None
+        self.robot = None
+        self._cpu_time = 0.0
+
+    def clone(self):
+        return PythonRobotController(self.file_name, self.init_kwargs)
+
+    def _timed(self, method, *args, **kwargs):
+        start = thread_cpu_time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if start is not None:
+                self._cpu_time += thread_cpu_time() - start
+
+    def _create_robot(self):
+        robot_class, self.module = compile_robot(self.file_name)
+        # Nothing else should see (and keep) state of the module, it is
+        # referenced only by the controller (globals of a module are
+        # cleared when it is deleted)
+        sys.modules.pop(self.module.__name__, None)
+        return robot_class()
+
+    def init(self, **kwargs):
+        assert len(kwargs) == 11, "Expected 11 parameters for constructor"
+        self.robot = self._timed(self._create_robot)
+        # Same values as read by the bots from the text protocol
+        kwargs = dict((key, float(value)) for key, value in kwargs.iteritems()
+                      if not self.init_kwargs or key in self.init_kwargs)
+        self._timed(self.robot.init, **kwargs)
+        self.implicit_color = getattr(self.robot, "implicit_color", True)
+
+    def _act(self, current_time, color):
+        if color is not None:
+            self.robot.on_sense_color(*color)
+        if hasattr(self.robot, "on_time"):
+            self.robot.on_time(current_time)
+        return list(self.robot.act())
+
+    def act(self, current_time, color=None):
+        return self._timed(self._act, current_time, color)
+
+    def on_sense_color(self, r, g, b):
+        self._timed(self.robot.on_sense_color, r, g, b)
+
+    def on_sense_sonar(self, dist):
+        self._timed(self.robot.on_sense_sonar, dist)
+
+    def on_sense_gps(self, x, y):
+        self._timed(self.robot.on_sense_gps, x, y)
+
+    def cpu_time(self, max_age=CPU_TIME_SAMPLE_INTERVAL):
+        """ @returns CPU time (in seconds) spent in the bot methods or None if not measured """
+        return self._cpu_time if _thread_cpu_clock is not None else None
+
 class PythonTimedRobotController(RobotController):
-    """ Wrapper class to manage time consumption (also for other language packages) """
+    """
+    Wrapper class to manage time consumption (also for other language packages)
+
+    Time charged to the bot (time_consumed) is its CPU time if the wrapped
+    controller can measure it, otherwise wall time of the calls.
+    """
     def __init__(self, rc):
         self.rc = rc
-        self.time_consumed = datetime.timedelta(0)
+        self.wall_time_consumed = datetime.timedelta(0)
 
     def clone(self):
         return PythonTimedRobotController(self.rc)
 
+    @property
+    def time_consumed(self):
+        return self.get_time_consumed()
+
+    def get_time_consumed(self, max_age=CPU_TIME_SAMPLE_INTERVAL):
+        """ @returns timedelta of CPU time (sampled at most every max_age seconds) or wall time """
+        cpu_time = self.rc.cpu_time(max_age)
+        if cpu_time is None:
+            return self.wall_time_consumed
+        return datetime.timedelta(seconds=cpu_time)
+
     def init(self, **kwargs):
         x = datetime.datetime.now()
         self.rc.init(**kwargs)
-        self.time_consumed += datetime.datetime.now() - x
+        self.wall_time_consumed += datetime.datetime.now() - x
+
+    @property
+    def implicit_color(self):
+        return self.rc.implicit_color
 
-    def act(self, current_time):
+    def act(self, current_time, color=None):
         """ Return next action """
         x = datetime.datetime.now()
-        ret = self.rc.act(current_time)
-        self.time_consumed += datetime.datetime.now() - x
+        ret = self.rc.act(current_time, color)
+        self.wall_time_consumed += datetime.datetime.now() - x
         return ret
 
+    def send_act(self, current_time, color=None):
+        x = datetime.datetime.now()
+        self.rc.send_act(current_time, color)
+        self.wall_time_consumed += datetime.datetime.now() - x
+
+    def receive_act(self):
+        """ Wall time of waiting for the reply before this call isn't counted """
+        x = datetime.datetime.now()
+        ret = self.rc.receive_act()
+        self.wall_time_consumed += datetime.datetime.now() - x
+        return ret
+
+    def fileno(self):
+        return self.rc.fileno()
+
+    def poll_timeout(self):
+        return self.rc.poll_timeout()
+
     def on_sense_sonar(self, dist):
         x = datetime.datetime.now()
         self.rc.on_sense_sonar(dist)
-        self.time_consumed += datetime.datetime.now() - x
+        self.wall_time_consumed += datetime.datetime.now() - x
 
     def on_sense_color(self, r, g, b):
         x = datetime.datetime.now()
         self.rc.on_sense_color(r, g, b)
-        self.time_consumed += datetime.datetime.now() - x
+        self.wall_time_consumed += datetime.datetime.now() - x
 
     def on_sense_gps(self, x, y):
         tmp = datetime.datetime.now()
         self.rc.on_sense_gps(x,y)
-        self.time_consumed += datetime.datetime.now() - tmp
+        self.wall_time_consumed += datetime.datetime.now() - tmp
+
+    def send_release(self):
+        self.rc.send_release()
+
+    def receive_release(self):
+        return self.rc.receive_release()
 
     def terminate(self):
-        self.tc.terminate()
+        self.rc.terminate()
+
+
+class ControllerPool(object):
+    """
+    Warm bot processes kept between runs (see CmdLineRobotController), so
+    that consecutive runs of the same bot in a process don't pay for starting
+    (and compiling) it again. At most size processes are kept, the least
+    recently used are closed
+    """
+    def __init__(self, size=CONTROLLER_POOL_SIZE):
+        self.size = size
+        self.processes = []  # (cmd, process) pairs, the most recently used last
+
+    def acquire(self, cmd):
+        """ @returns warm process of the command (removed from the pool) or None """
+        for i in reversed(xrange(len(self.processes))):
+            if self.processes[i][0] == cmd:
+                process = self.processes.pop(i)[1]
+                if process.poll() is None:
+                    return process
+        return None
+
+    def release(self, cmd, process):
+        self.processes.append((cmd, process))
+        while len(self.processes) > self.size:
+            self.processes.pop(0)[1].communicate()
+
+    def close(self):
+        """ Closes all the kept processes (they get end of input) """
+        while self.processes:
+            self.processes.pop()[1].communicate()
+
+def _read_proc_stat(pid):
+    """ @returns fields of /proc/<pid>/stat following the command name """
+    with open("/proc/%d/stat" % pid) as f:
+        stat = f.read()
+    return stat[stat.rindex(")") + 2:].split()
+
+def _process_children(pid):
+    """ @returns pids of direct children of the process (needs /proc/<pid>/task/<tid>/children) """
+    children = []
+    task_dir = "/proc/%d/task" % pid
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, "children")) as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+def _all_process_stats():
+    """ @returns dict pid -> stat fields for all processes, and dict pid -> children pids """
+    stats, children = {}, {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                stats[int(entry)] = _read_proc_stat(int(entry))
+            except (IOError, OSError):
+                continue
+            children.setdefault(int(stats[int(entry)][1]), []).append(int(entry))
+    return stats, children
+
+_PROC_CHILDREN_SUPPORTED = os.path.exists("/proc/%d/task/%d/children" % (os.getpid(), os.getpid()))
+
+def process_tree_cpu_time(pid):
+    """
+    @returns user + system CPU time (in seconds) of the process and all its
+    descendants (including already finished children it has waited for),
+    or None if it cannot be read from /proc
+    """
+    try:
+        if _PROC_CHILDREN_SUPPORTED:
+            stats, children = {}, None
+        else:
+            # Full scan of /proc is needed to find descendants
+            stats, children = _all_process_stats()
+
+        ticks = 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            fields = stats[current] if current in stats else _read_proc_stat(current)
+            # utime, stime, cutime, cstime
+            ticks += sum(int(value) for value in fields[11:15])
+            pending.extend(children.get(current, []) if children is not None else _process_children(current))
+        return float(ticks) / os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+# From <time.h> on Linux
+CLOCK_THREAD_CPUTIME_ID = 3
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _load_thread_cpu_clock():
+    """ @returns clock_gettime function of libc (or librt) or None if not available """
+    for library in ("c", "rt"):
+        try:
+            clock_gettime = ctypes.CDLL(ctypes.util.find_library(library)).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        clock_gettime.restype = ctypes.c_int
+        if clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(_timespec())) == 0:
+            return clock_gettime
+    return None
+
+_thread_cpu_clock = _load_thread_cpu_clock()
+
+def thread_cpu_time():
+    """ @returns CPU time (in seconds) of the calling thread or None if not available """
+    if _thread_cpu_clock is None:
+        return None
+    timespec = _timespec()
+    _thread_cpu_clock(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(timespec))
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
 
 def importCode(file_name, name):
     import imp
@@ -122,13 +601,107 @@ def compile_robot(file_name, module_name = "contestant_module"):
     for symbol in dir(mod):
         if hasattr(getattr(mod, symbol), "act") and getattr(mod, symbol).__name__ != "RobotController":
             compiled_class = getattr(mod, symbol)
-    print compiled_class
-    globals()[compiled_class.__name__] = compiled_class
     if compiled_class is None:
         raise KrakrobotException("Not found class with act() function named different than RobotController in provided .py")
+    globals()[compiled_class.__name__] = compiled_class
     return compiled_class, mod
 
-def construct_cmd_robot(cmd):
+def _source_files(source_dir):
+    """ @returns sorted paths (relative to source_dir) of the submission sources """
+    files = []
+    for root, dirs, names in os.walk(source_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in names:
+            if name.startswith(".") or name in BUILD_IGNORED_FILES \
+                    or os.path.splitext(name)[1] in BUILD_IGNORED_EXTENSIONS:
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(files)
+
+def _sources_hash(source_dir, files):
+    digest = hashlib.sha1()
+    for name in files:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            content = f.read()
+        digest.update("%s\0%d\0" % (name, len(content)))
+        digest.update(content)
+    return digest.hexdigest()
+
+def _java_main_class(build_dir, files):
+    for name in files:
+        if name.endswith(".java"):
+            with open(os.path.join(build_dir, name)) as f:
+                source = f.read()
+            if re.search(r"static\s+void\s+main\s*\(", source):
+                package = re.search(r"^\s*package\s+([\w.]+)\s*;", source, re.MULTILINE)
+                class_name = os.path.splitext(os.path.basename(name))[0]
+                return package.group(1) + "." + class_name if package else class_name
+    raise KrakrobotException("Not found class with main() in Java sources")
+
+def _build(build_dir, files):
+    """ Builds sources copied to build_dir """
+    if "Makefile" in files:
+        cmd = ["make", BUILD_MAKE_TARGET]
+    else:
+        cmd = ["javac"] + [name for name in files if name.endswith(".java")]
+    with open(os.path.join(build_dir, BUILD_LOG), "w") as log:
+        return_code = subprocess.call(cmd, cwd=build_dir, stdout=log, stderr=subprocess.STDOUT)
+    if return_code != 0:
+        with open(os.path.join(build_dir, BUILD_LOG)) as log:
+            raise KrakrobotException("Build failed (" + " ".join(cmd) + "):\n" + log.read())
+
+def build_robot(source_dir, cache_dir=BUILD_CACHE_DIR):
+    """
+    Builds submission (directory with Makefile or .java files) into cache
+    directory named by sha1 of its sources, unless it is already built, and
+    returns command running the built bot.
+
+    Every build is done in its own temporary directory, which is then
+    atomically renamed, so concurrent builds of the same sources are safe
+    (the first one is kept)
+    """
+    source_dir = os.path.abspath(source_dir)
+    files = _source_files(source_dir)
+    if "Makefile" not in files and not any(name.endswith(".java") for name in files):
+        raise KrakrobotException("Don't know how to build " + source_dir + " (expected Makefile or .java files)")
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    build_dir = os.path.join(cache_dir, _sources_hash(source_dir, files))
+
+    if not os.path.isdir(build_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+        tmp_dir = tempfile.mkdtemp(prefix=".build-", dir=cache_dir)
+        os.chmod(tmp_dir, 0755)
+        try:
+            for name in files:
+                if not os.path.isdir(os.path.dirname(os.path.join(tmp_dir, name))):
+                    os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)))
+                shutil.copy2(os.path.join(source_dir, name), os.path.join(tmp_dir, name))
+            _build(tmp_dir, files)
+            try:
+                os.rename(tmp_dir, build_dir)
+            except OSError:
+                # Already built by another process
+                if not os.path.isdir(build_dir):
+                    raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+
+    if "Makefile" in files:
+        return pipes.quote(os.path.join(build_dir, BUILD_BINARY))
+    return "java -cp " + pipes.quote(build_dir) + " " + _java_main_class(build_dir, files)
+
+ROBOT_INIT_KWARGS = ["x", "y", "angle", "steering_noise", "distance_noise", "forward_steering_drift",
+                     "speed", "turning_speed", "execution_cpu_time_limit", "N", "M"]
+
+def construct_cmd_robot(cmd, pool=None):
     """ Compiles robot from given file and returns class object """
-    return CmdLineRobotController(cmd=cmd, init_kwargs=["x", "y", "angle", "steering_noise",
-             "distance_noise", "forward_steering_drift", "speed", "turning_speed", "execution_cpu_time_limit", "N", "M"])
+    return CmdLineRobotController(cmd=cmd, pool=pool, init_kwargs=ROBOT_INIT_KWARGS)
+
+def construct_python_robot(file_name):
+    """ @returns controller running bot class from the Python file in the simulator process """
+    return PythonRobotController(file_name, init_kwargs=ROBOT_INIT_KWARGS)
@@ -15,18 +15,20 @@ from math import (
 )
 import traceback
 
-from map import load_map
+from map import get_map, get_sonar_table
 from misc.defines import *
 from robot import Robot
-from robot_controller import PythonTimedRobotController
+from trajectory import TrajectoryRecorder
+from replay import write_replay
+from misc.visualisation import BoardSVG
+from robot_controller import PythonTimedRobotController, wait_for_controller
+from instrumentation import SimulationStats
 import logging
 
-logging.basicConfig(level=logging.INFO)
+# Handlers are configured by the application (see main.py), simulator logs
+# are passed to them only with print_logger
 logger = logging.getLogger(__name__)
-ch = logging.StreamHandler()
-formatter = logging.Formatter('%(funcName)s - %(asctime)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+logger.addHandler(logging.NullHandler())
 logger.propagate = False
 
 class KrakrobotSimulator(object):
@@ -54,6 +56,9 @@ class KrakrobotSimulator(object):
                  print_robot=True,
                  seed=777,
                  print_logger=False,
+                 macro_step=True,
+                 sonar_table=True,
+                 stats_file=None,
                  accepted_commands=[TURN, MOVE, BEEP, FINISH, SENSE_COLOR]
                  ):
         """
@@ -63,6 +68,7 @@ class KrakrobotSimulator(object):
             :param distance_noise - variance of distance in move
             :param measurement_noise - variance of measurement (GPS??)
             :param map - map for the robot simulator representing the maze or file to map
+                (maps loaded from files are cached, see map.get_map)
             :param init_position - starting position of the Robot (can be moved to map class) [x,y,heading]
             :param speed - distance travelled by one move action (cannot be bigger than 0.5, or he could traverse the walls)
             :param simulation_time_limit - limit in ms for whole robot execution (also with init)
@@ -70,10 +76,22 @@ class KrakrobotSimulator(object):
             :param simulation_dt -  controlls simulation calculation intensivity
             :param frame_dt - save frame every dt
             :param robot - RobotController class that will be simulated in run procedure
+            :param macro_step - execute whole MOVE/TURN commands in one vectorized batch
+                (used only in command_line mode, as no frames are produced then)
+            :param sonar_table - answer sonar queries using distances precomputed for the map
+                (results are the same as with casting a ray for every query)
+            :param stats_file - file to write counters of the simulation to as JSON lines
+                (snapshot every iteration_write_frequency iterations and the final one)
         """
 
+        # TODO: Disable logger printing when needed
+        if print_logger:
+            logger.propagate = True
+        else:
+            logger.propagate = False
+
         if type(map) is str :
-            self.map = load_map(map)
+            self.map = get_map(map)
             for row in self.map['board']:
                 logger.info(row)
         else:
@@ -102,6 +120,9 @@ class KrakrobotSimulator(object):
         self.accepted_commands = accepted_commands
 
         self.command_line = command_line
+        self.macro_step = macro_step
+        self.sonar_table = sonar_table
+        self.stats_file = stats_file
 
         self.sonar_time = SONAR_TIME
         self.gps_delay = gps_delay
@@ -120,27 +141,22 @@ class KrakrobotSimulator(object):
         self.steering_noise = steering_noise
         self.reset()
 
-        # TODO: Disable logger printing when needed
-        if self.print_logger:
-            logger.propagate = True
-        else:
-            logger.propagate = False
-
         for i in xrange(self.map['N']):
             for j in xrange(self.map['M']):
                 if self.map['board'][i][j] == MAP_GOAL:
                     self.goal = (i, j)
 
-    def get_next_frame(self):
+    def get_next_frame(self, timeout=None):
         """
             @returns next frame of simulation data
 
             @note the queue is thread-safe and it works like consumer-producer
-            those frames should be consumed by rendering thread
+            those frames should be consumed by rendering thread. If timeout
+            is given, raises the Empty exception when no frame arrived in time
         """
         # if len(self.sim_frames) == 0: return None
 
-        return self.sim_frames.get()
+        return self.sim_frames.get(timeout=timeout)
 
     def get_next_frame_nowait(self):
         """
@@ -153,9 +169,19 @@ class KrakrobotSimulator(object):
 
     def reset(self):
         """ Reset state of the KrakrobotSimulator """
-        self.robot_path = []
-        self.collisions = []
+        # Full resolution trace (pose after every tick), path sampled at
+        # frames, rejected (colliding) poses and poses of beeps
+        self.trajectory = TrajectoryRecorder()
+        self.robot_path = TrajectoryRecorder()
+        self.collisions = TrajectoryRecorder()
+        self.beeps = TrajectoryRecorder()
+        # Lines written by the robot as (time, text) pairs
+        self.console_lines = []
+        # Number of path points and beeps already sent in frames
+        self.frame_path_sent = 0
+        self.frame_sparks_sent = 0
         self.results = None
+        self.returned_results = None
 
         self.goal_achieved = False
         self.robot_timer = 0.0
@@ -166,10 +192,26 @@ class KrakrobotSimulator(object):
         self.terminate_flag = False
 
         self.logs = []
+        self.stats = SimulationStats()
+        self.stats_counters = None
 
     def run(self):
         """ Runs simulations by quering the robot """
+        for robot_controller in self.run_iter():
+            wait_for_controller(robot_controller)
+        return self.returned_results
+
+    def run_iter(self):
+        """
+        Runs simulation as a generator, which yields the robot controller
+        whenever it waits for a reply of the bot. The reply can be received
+        without blocking once fileno() of the controller is readable (or at
+        once if it is None, or after poll_timeout()), see orchestrator.py. Result of run() is stored
+        in returned_results when the generator is exhausted
+        """
         self.reset()
+        if self.stats_file:
+            self.stats = SimulationStats(open(self.stats_file, "w"), self.iteration_write_frequency)
 
         # Initialize robot object
         robot = Robot(self.speed, self.turning_speed, self.gps_delay, self.sonar_time, TICK_MOVE, TICK_ROTATE, seed=self.seed)
@@ -199,14 +241,18 @@ class KrakrobotSimulator(object):
 
         maximum_timedelta = datetime.timedelta(seconds=self.execution_cpu_time_limit)
 
-        self.robot_path.append((robot.x, robot.y))
+        command_id = -1  # Number of commands received from the robot controller
+        self.trajectory.append(*robot.pose() + (command_id,))
+        self.robot_path.append(*robot.pose() + (command_id,))
         collision_counter = 0  # We have maximum collision allowed
 
+        board = np.array(self.map['board'])
+        macro_step = self.macro_step and self.command_line
+
         frame_time_left = self.simulation_dt
         frame_count = 0
         current_command = None
         iteration = 0
-        beeps = []
         communicated_finished = False
         try:
             while not communicated_finished \
@@ -216,11 +262,9 @@ class KrakrobotSimulator(object):
                 if maximum_timedelta <= robot_controller.time_consumed:
                     raise KrakrobotException("Robot has exceeded CPU time limit")
 
-                if iteration % self.iteration_write_frequency == 0:
-                    logger.info("Iteration {0}, produced {1} frames".format(iteration,
-                                                                            frame_count))
-                    logger.info("Elapsed {0}".format(robot.time_elapsed))
-                    logger.info("Current command: {}".format(current_command))
+                if iteration >= self.stats.next_snapshot:
+                    self.stats.snapshot("progress", iteration, robot.time_elapsed,
+                                        self._stats_counters(frame_count))
 
                 iteration += 1
 
@@ -228,30 +272,51 @@ class KrakrobotSimulator(object):
                     ### Save frame <=> last command took long ###
                     if len(self.robot_path) == 0 or \
                                     robot.x != self.robot_path[-1][0] or robot.y != self.robot_path[-1][1]:
-                        self.robot_path.append((robot.x, robot.y))
-                    self.sim_frames.put(self._create_sim_data(robot, beeps))
+                        self.robot_path.append(*robot.pose() + (command_id,))
+                    self.sim_frames.put(self._create_sim_data(robot))
 
                     frame_count += 1
                     frame_time_left -= self.frame_dt
 
-                if current_command is not None:
+                if current_command is not None and macro_step:
+                    ### Process whole current command at once ###
+
+                    if current_command[0] == TURN:
+                        robot.turn_ticks(current_command[1], self.simulation_time_limit,
+                                         recorder=self.trajectory, command_id=command_id)
+                    elif current_command[0] == MOVE:
+                        for proposed_pose in robot.move_ticks(current_command[1], board, self.simulation_time_limit,
+                                                              COLLISION_THRESHOLD - collision_counter,
+                                                              recorder=self.trajectory, command_id=command_id):
+                            collision_counter += 1
+                            self.collisions.append(*proposed_pose + (command_id,))
+                        if collision_counter >= COLLISION_THRESHOLD:
+                            raise KrakrobotException \
+                                ("The robot has been destroyed by a wall.")
+                    else:
+                        raise KrakrobotException("The robot hasn't supplied any command")
+
+                    current_command = None
+
+                elif current_command is not None:
                     ### Process current command ###
 
                     if current_command[0] == TURN:
-                        robot = robot.turn(np.sign(current_command[1]))
+                        robot.turn(np.sign(current_command[1]))
+                        self.trajectory.append(*robot.pose() + (command_id,))
                         frame_time_left += TICK_ROTATE / self.turning_speed
                     elif current_command[0] == MOVE:
-                        robot_proposed = robot.move(np.sign(current_command[1]))
+                        proposed_pose = robot.propose_move(np.sign(current_command[1]))
 
-                        if not robot_proposed.check_collision(self.map['board']):
+                        if not robot.check_collision(self.map['board'], proposed_pose):
                             collision_counter += 1
-                            self.collisions.append((robot_proposed.x, robot_proposed.y))
-                            logger.error("Collision")
+                            self.collisions.append(*proposed_pose + (command_id,))
                             if collision_counter >= COLLISION_THRESHOLD:
                                 raise KrakrobotException \
                                     ("The robot has been destroyed by a wall.")
                         else:
-                            robot = robot_proposed
+                            robot.commit(proposed_pose)
+                            self.trajectory.append(*proposed_pose + (command_id,))
 
                         frame_time_left += TICK_MOVE / self.speed
                     else:
@@ -267,9 +332,16 @@ class KrakrobotSimulator(object):
 
                     command = None
                     try:
-                        r, g, b = robot.sense_color(self.map)
-                        robot_controller.on_sense_color(r, g, b)
-                        command = robot_controller.act(robot.time_elapsed)
+                        # Color is sent together with act request, unless the
+                        # controller wants it only on SENSE_COLOR
+                        if robot_controller.implicit_color:
+                            self.stats.color_readings += 1
+                            robot_controller.send_act(robot.time_elapsed, robot.sense_color(self.map))
+                        else:
+                            robot_controller.send_act(robot.time_elapsed)
+                        while command is None:
+                            yield robot_controller
+                            command = robot_controller.receive_act()
                     except Exception, e:
                         logger.error("Robot controller failed with exception " + str(e))
                         logger.error(traceback.format_exc())
@@ -280,12 +352,14 @@ class KrakrobotSimulator(object):
                         raise KrakrobotException("No command returned from the robot controller")
 
                     command = list(command)
+                    command_id += 1
 
                     if len(command) == 0:
                         raise KrakrobotException("Zero length command returned from the robot controller")
 
                     if command[0] not in self.accepted_commands:
                         raise KrakrobotException("Not allowed command " + str(command[0]))
+                    self.stats.count_command(command[0])
 
                     # Dispatch command
                     if command[0] == SENSE_GPS:
@@ -296,13 +370,16 @@ class KrakrobotSimulator(object):
                                    ", 'time': " + str(robot.time_elapsed) + \
                                    '}:\n' + command[1]
                         self.logs.append(new_line)
+                        self.console_lines.append((robot.time_elapsed, command[1]))
                         if self.print_robot:
                             print new_line
                     elif command[0] == SENSE_SONAR:
-                        w = robot.sense_sonar(self.map['board'])
+                        w = robot.sense_sonar(self.map['board'],
+                                              get_sonar_table(self.map) if self.sonar_table else None)
                         robot_controller.on_sense_sonar(w)
                         frame_time_left += self.sonar_time
                     elif command[0] == SENSE_COLOR:
+                        self.stats.color_readings += 1
                         r, g, b = robot.sense_color(self.map)
                         robot_controller.on_sense_color(r, g, b)
                         frame_time_left += self.light_sensor_time
@@ -323,7 +400,7 @@ class KrakrobotSimulator(object):
                         except ValueError:
                             raise KrakrobotException("MOVE: Incorrect argument type: expected int, got '{}'".format(current_command[1]))
                     elif command[0] == BEEP:
-                        beeps.append((robot.x, robot.y, robot.time_elapsed))
+                        self.beeps.append(*robot.pose() + (command_id,))
                     elif command[0] == FINISH:
                         logger.info("Communicated finishing")
                         communicated_finished = True
@@ -335,12 +412,22 @@ class KrakrobotSimulator(object):
             self.error = str(e)
             self.error_traceback = str(traceback.format_exc())
 
-        self.sim_frames.put(self._create_sim_data(robot, beeps))
+        # Bot process can be reused by the next run (its CPU time is kept)
+        robot_controller.send_release()
+        while robot_controller.receive_release() is None:
+            yield robot_controller
+
+        self.sim_frames.put(self._create_sim_data(robot))
         while frame_time_left >= self.frame_dt and not self.command_line and not self.terminate_flag:
             ### Save frame <=> last command took long ###
-            self.sim_frames.put(self._create_sim_data(robot, beeps))
+            self.sim_frames.put(self._create_sim_data(robot))
             frame_time_left -= self.frame_dt
 
+        self.stats_counters = self._stats_counters(frame_count)
+        self.stats.snapshot("end", iteration, robot.time_elapsed, self.stats_counters)
+        if self.stats.stream is not None:
+            self.stats.stream.close()
+
         # Simulation process finished
         self.finished = True
         logger.info("Exiting")
@@ -349,14 +436,17 @@ class KrakrobotSimulator(object):
             # Return simulation results
             map_to_save = dict(self.map)
             del map_to_save['color_bitmap']
+            map_to_save.pop('sonar_table', None)
+            map_to_save.pop('color_table', None)
             self.results = {
                 "final_position": (robot.x, robot.y),
                 "sim_time": robot.time_elapsed,
-                "cpu_time": robot_controller.time_consumed.total_seconds(),
+                "cpu_time": robot_controller.get_time_consumed(max_age=0).total_seconds(),
+                "wall_time": robot_controller.wall_time_consumed.total_seconds(),
                 "error": self.error or False,
                 "error_traceback": self.error_traceback or False,
                 "finished": communicated_finished,
-                "beeps": beeps,
+                "beeps": self.beeps.tuples(("x", "y", "time_elapsed")),
                 "map": map_to_save,
                 "parameters": {
                     "distance_noise": self.distance_noise,
@@ -367,6 +457,7 @@ class KrakrobotSimulator(object):
             }
 
             # calculate points for this year's task
+            beeps = self.results["beeps"]
 
             # if there was any error in the simulation
             if self.error:
@@ -396,13 +487,13 @@ class KrakrobotSimulator(object):
 
 
             logger.info("Simulation ended after " + str(robot.time_elapsed) + " seconds, communicated_finish=" + str(
-                communicated_finished))
-            return self.results
+                communicated_finished) + ", collisions=" + str(self.stats_counters["collisions"]))
+            self.returned_results = self.results
 
         except Exception, e:
             self.results = None
             logger.error("Failed constructing result " + str(e))
-            return {"error": str(e)}
+            self.returned_results = {"error": str(e)}
 
     def get_results(self):
         return self.results
@@ -410,17 +501,60 @@ class KrakrobotSimulator(object):
     def get_logs(self):
         return self.logs
 
-    def _create_sim_data(self, robot, beeps):
+    def get_stats(self):
+        """ :returns counters of the last run (see SimulationStats.counters) """
+        return self.stats_counters
+
+    def _stats_counters(self, frame_count):
+        # Every tick is either recorded in the trajectory or rejected
+        return self.stats.counters(len(self.trajectory) - 1 + len(self.collisions),
+                                   len(self.collisions), frame_count)
+
+    def save_trajectory(self, file_name):
+        """ Saves trajectory, collisions and beeps of the last run to .npz file """
+        self.trajectory.save_npz(file_name, collisions=self.collisions, beeps=self.beeps)
+
+    def save_replay(self, file_name):
+        """ Saves the last run to replay file, that can be watched in the GUI """
+        if self.results is None:
+            raise KrakrobotException("No results of the run to save in the replay (run failed or wasn't finished)")
+        results = dict(self.results)
+        # Board is embedded, so that the replay doesn't depend on the map files
+        map_ = dict(results.pop("map"))
+        map_["board_svg"] = BoardSVG(map_)
+        header = {
+            "map": map_,
+            "results": results,
+            "parameters": {
+                "init_position": self.init_position,
+                "frame_dt": self.frame_dt,
+                "speed": self.speed,
+                "turning_speed": self.turning_speed,
+                "simulation_time_limit": self.simulation_time_limit,
+                "execution_cpu_time_limit": self.execution_cpu_time_limit,
+                "steering_noise": self.steering_noise,
+                "distance_noise": self.distance_noise,
+                "forward_steering_drift": self.forward_steering_drift,
+                "seed": self.seed,
+            }
+        }
+        write_replay(file_name, header, self.trajectory, self.beeps, self.collisions, self.console_lines)
+
+    def _create_sim_data(self, robot):
         """
             @returns Descriptor that is sufficient to visualize current frame
+            given all previous frames: it carries only path points and beeps
+            added since the previous frame (NewPath and NewSparks)
         """
         data = {}
-        data['Sparks'] = list(beeps)  # ommiting errors list(self.collisions)
-        data['ActualPath'] = list(self.robot_path)
+        data['NewSparks'] = self.beeps.tuples(("x", "y", "time_elapsed"), self.frame_sparks_sent)  # ommiting errors self.collisions
+        data['NewPath'] = self.robot_path.tuples(("x", "y"), self.frame_path_sent)
         data['ActualPosition'] = [robot.x, robot.y]
         data['ActualOrientation'] = robot.orientation
         data['Map'] = self.map
         data['StartPos'] = self.init_position
+        self.frame_sparks_sent = len(self.beeps)
+        self.frame_path_sent = len(self.robot_path)
         return data
 
     def terminate(self):
@@ -0,0 +1,89 @@
+""" Columnar storage of robot trajectories """
+
+import numpy as np
+
+
+class TrajectoryRecorder(object):
+    """
+    Records robot poses in growable preallocated numpy arrays (one row per
+    column, capacity is doubled when full, so appends are amortized O(1))
+    """
+
+    columns = ("x", "y", "orientation", "time_elapsed", "command_id")
+
+    def __init__(self, capacity=1024):
+        self._data = np.empty((len(self.columns), capacity))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        """
+        :returns recorded pose as (x, y, orientation, time_elapsed, command_id) tuple
+        """
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("TrajectoryRecorder index out of range")
+        row = self._data[:, index].tolist()
+        row[-1] = int(row[-1])
+        return tuple(row)
+
+    def _reserve(self, size):
+        if size > self._data.shape[1]:
+            data = np.empty((len(self.columns), max(size, 2 * self._data.shape[1])))
+            data[:, :self._size] = self._data[:, :self._size]
+            self._data = data
+
+    def append(self, x, y, orientation=0.0, time_elapsed=0.0, command_id=-1):
+        self._reserve(self._size + 1)
+        self._data[:, self._size] = (x, y, orientation, time_elapsed, command_id)
+        self._size += 1
+
+    def extend(self, x, y, orientation=0.0, time_elapsed=0.0, command_id=-1):
+        """
+        Appends many poses at once (arguments are arrays of equal length or
+        scalars shared by all the poses)
+        """
+        n = np.broadcast(x, y, orientation, time_elapsed, command_id).size
+        self._reserve(self._size + n)
+        for row, values in enumerate((x, y, orientation, time_elapsed, command_id)):
+            self._data[row, self._size:self._size + n] = values
+        self._size += n
+
+    def clear(self):
+        self._size = 0
+
+    def column(self, name):
+        """
+        :returns view of the recorded values of the column (command_id is
+            returned as a copy with integer type)
+        """
+        values = self._data[self.columns.index(name), :self._size]
+        if name == "command_id":
+            return values.astype(int)
+        return values
+
+    def tuples(self, columns=("x", "y"), start=0):
+        """
+        :returns list of tuples with values of given columns of the poses
+            recorded since start
+        """
+        return zip(*[self.column(name)[start:].tolist() for name in columns])
+
+    def arrays(self, prefix=""):
+        """
+        :returns dict of column arrays (copies), keys are prefixed column names
+        """
+        return dict((prefix + name, self.column(name).copy()) for name in self.columns)
+
+    def save_npz(self, file_name, **recorders):
+        """
+        Saves recorded columns (and columns of other recorders, prefixed with
+        keyword argument name) to numpy .npz file
+        """
+        arrays = self.arrays()
+        for name, recorder in recorders.iteritems():
+            arrays.update(recorder.arrays(prefix=name + "_"))
+        np.savez(file_name, **arrays)
@@ -0,0 +1,76 @@
+""" Tests of path simplification (run with python2.7 -m unittest discover -s tests) """
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from misc.visualisation import simplify_path, IncrementalPath, _simplified_indices
+
+
+def segment_distance(point, start, end):
+    point, start, end = [np.asarray(p, dtype=np.float64) for p in (point, start, end)]
+    direction = end - start
+    if not direction.any():
+        return np.hypot(*(point - start))
+    t = min(max((point - start).dot(direction) / direction.dot(direction), 0.0), 1.0)
+    return np.hypot(*(point - start - t * direction))
+
+
+def max_deviation(vertices, indices):
+    """ :returns maximum distance of the vertices from the simplified segment spanning them """
+    deviation = 0.0
+    for first, last in zip(indices[:-1], indices[1:]):
+        for k in xrange(first + 1, last):
+            deviation = max(deviation, segment_distance(vertices[k], vertices[first], vertices[last]))
+    return deviation
+
+
+def random_walk(count, seed=1):
+    """ Path of the robot moving forward and back along changing headings """
+    rng = np.random.RandomState(seed)
+    steps = np.repeat(rng.choice([-1.0, 1.0], count // 20), 20)[:, np.newaxis] * 0.01
+    headings = np.repeat(rng.uniform(0, 2 * np.pi, count // 100), 100)
+    moves = steps * np.column_stack((np.cos(headings), np.sin(headings)))
+    return (np.cumsum(moves, axis=0) + 2.5).tolist()
+
+
+class SimplifyPathTest(unittest.TestCase):
+
+    def test_back_and_forth(self):
+        path = [(2.5, 2.5), (3, 2.5), (3.5, 2.5), (4, 2.5), (3.5, 2.5), (3, 2.5)]
+        self.assertEqual(simplify_path(path, 0.01), [(2.5, 2.5), (4, 2.5), (3, 2.5)])
+
+    def test_tolerance_bound(self):
+        path = random_walk(5000)
+        indices = _simplified_indices(np.asarray(path), 0.01)
+        self.assertLess(len(indices), len(path))
+        self.assertLessEqual(max_deviation(path, indices), 0.01)
+
+
+class IncrementalPathTest(unittest.TestCase):
+
+    def test_back_and_forth(self):
+        path = [(2.5, 2.5), (3, 2.5), (3.5, 2.5), (4, 2.5), (3.5, 2.5), (3, 2.5)]
+        at_once, by_vertex = IncrementalPath(0.01), IncrementalPath(0.01)
+        at_once.update(path)
+        for length in xrange(1, len(path) + 1):
+            by_vertex.update(path, length)
+        self.assertEqual(at_once.vertices(path), [(2.5, 2.5), (4, 2.5), (3, 2.5)])
+        self.assertEqual(by_vertex.vertices(path), [(2.5, 2.5), (4, 2.5), (3, 2.5)])
+
+    def test_tolerance_bound(self):
+        path = random_walk(5000)
+        incremental = IncrementalPath(0.01, tail_size=200)
+        for length in xrange(1, len(path) + 1, 7):
+            incremental.update(path, length)
+        incremental.update(path)
+        self.assertEqual(incremental.indices[-1], len(path) - 1)
+        self.assertLessEqual(max_deviation(path, incremental.indices), 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()